@@ -3,14 +3,16 @@ Authentication and API key management endpoints
 """
 
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List
 from datetime import datetime
 
 from app.core.database import get_db
-from app.core.security import api_key_manager
-from app.models.database import User, ApiKey
+from app.core.security import ApiKeySnapshot, UserSnapshot, api_key_manager
+from app.models.database import User
 from app.middleware.auth import get_current_user, get_current_api_key
 from app.services.rate_limiter import rate_limiter
 
@@ -80,28 +82,28 @@ class QuotaResponse(BaseModel):
 
 # ==================== USER ENDPOINTS ====================
 
+def _duplicate_user_detail(existing_email: Optional[str], user_data: UserCreate) -> str:
+    if existing_email == user_data.email:
+        return "Email already registered"
+    return "Username already taken"
+
+
 @router.post("/users", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def create_user(user_data: UserCreate, db: Session = Depends(get_db)):
+def create_user(user_data: UserCreate, db: Session = Depends(get_db)):
     """
     Crear un nuevo usuario
     
     Para desarrollo/testing. En producción, esto estaría protegido
     o se haría mediante un flujo de registro más complejo.
     """
-    # Verificar si el email ya existe
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
-    if existing_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered"
-        )
-    
-    # Verificar si el username ya existe
-    existing_username = db.query(User).filter(User.username == user_data.username).first()
-    if existing_username:
+    # Verificar email y username en una sola consulta
+    existing = db.query(User.email, User.username).filter(
+        or_(User.email == user_data.email, User.username == user_data.username)
+    ).first()
+    if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username already taken"
+            detail=_duplicate_user_detail(existing.email, user_data)
         )
     
     # Crear usuario
@@ -115,14 +117,23 @@ async def create_user(user_data: UserCreate, db: Session = Depends(get_db)):
     )
     
     db.add(user)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Otro request registró el mismo email/username entre el SELECT y el INSERT
+        db.rollback()
+        existing = db.query(User.email).filter(User.email == user_data.email).first()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=_duplicate_user_detail(existing.email if existing else None, user_data)
+        )
     db.refresh(user)
     
     return user
 
 
 @router.get("/users/me", response_model=UserResponse)
-async def get_current_user_info(user: User = Depends(get_current_user)):
+async def get_current_user_info(user: UserSnapshot = Depends(get_current_user)):
     """
     Obtener información del usuario actual autenticado
     """
@@ -132,9 +143,9 @@ async def get_current_user_info(user: User = Depends(get_current_user)):
 # ==================== API KEY ENDPOINTS ====================
 
 @router.post("/keys", response_model=ApiKeyResponse, status_code=status.HTTP_201_CREATED)
-async def create_api_key(
+def create_api_key(
     key_data: ApiKeyCreate,
-    user: User = Depends(get_current_user),
+    user: UserSnapshot = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
@@ -150,16 +161,22 @@ async def create_api_key(
         expires_days=key_data.expires_days
     )
     
-    # Retornar con la key completa (solo esta vez)
-    response = ApiKeyResponse.from_orm(api_key_obj)
-    response.key = plain_key  # Mostrar key completa
-    
-    return response
+    # Retornar con la key completa (solo esta vez); datos propios, sin revalidar
+    return ApiKeyResponse.model_construct(
+        id=api_key_obj.id,
+        name=api_key_obj.name,
+        key=plain_key,
+        is_active=api_key_obj.is_active,
+        created_at=api_key_obj.created_at,
+        expires_at=api_key_obj.expires_at,
+        last_used_at=None,
+        total_requests=0
+    )
 
 
 @router.get("/keys", response_model=List[ApiKeyListResponse])
-async def list_api_keys(
-    user: User = Depends(get_current_user),
+def list_api_keys(
+    user: UserSnapshot = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
@@ -171,13 +188,10 @@ async def list_api_keys(
     
     result = []
     for key in keys:
-        # Mostrar solo preview de la key
-        key_preview = f"{key.key[:15]}...{key.key[-4:]}" if len(key.key) > 20 else key.key
-        
         result.append(ApiKeyListResponse(
             id=key.id,
             name=key.name,
-            key_preview=key_preview,
+            key_preview=key.key_preview,
             is_active=key.is_active,
             created_at=key.created_at,
             expires_at=key.expires_at,
@@ -189,9 +203,9 @@ async def list_api_keys(
 
 
 @router.delete("/keys/{key_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def revoke_api_key(
+def revoke_api_key(
     key_id: int,
-    user: User = Depends(get_current_user),
+    user: UserSnapshot = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
@@ -199,40 +213,27 @@ async def revoke_api_key(
     
     La key dejará de funcionar inmediatamente.
     """
-    # Verificar que la key pertenece al usuario
-    key = db.query(ApiKey).filter(
-        ApiKey.id == key_id,
-        ApiKey.user_id == user.id
-    ).first()
+    # Solo revoca si la key pertenece al usuario
+    revoked = api_key_manager.revoke_api_key(db, key_id, user_id=user.id)
     
-    if not key:
+    if not revoked:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="API key not found"
         )
     
-    success = api_key_manager.revoke_api_key(db, key_id)
-    
-    if not success:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to revoke key"
-        )
-    
     return None
 
 
 @router.get("/keys/current", response_model=ApiKeyListResponse)
-async def get_current_key_info(api_key: ApiKey = Depends(get_current_api_key)):
+async def get_current_key_info(api_key: ApiKeySnapshot = Depends(get_current_api_key)):
     """
     Obtener información sobre la API key actual en uso
     """
-    key_preview = f"{api_key.key[:15]}...{api_key.key[-4:]}"
-    
     return ApiKeyListResponse(
         id=api_key.id,
         name=api_key.name,
-        key_preview=key_preview,
+        key_preview=api_key.key_preview,
         is_active=api_key.is_active,
         created_at=api_key.created_at,
         expires_at=api_key.expires_at,
@@ -244,8 +245,8 @@ async def get_current_key_info(api_key: ApiKey = Depends(get_current_api_key)):
 # ==================== QUOTA ENDPOINTS ====================
 
 @router.get("/quota", response_model=QuotaResponse)
-async def get_quota_info(
-    user: User = Depends(get_current_user),
+def get_quota_info(
+    user: UserSnapshot = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
@@ -263,8 +264,8 @@ async def get_quota_info(
 
 
 @router.post("/quota/reset", status_code=status.HTTP_200_OK)
-async def reset_quota(
-    user: User = Depends(get_current_user),
+def reset_quota(
+    user: UserSnapshot = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
@@ -285,9 +286,9 @@ async def reset_quota(
 
 
 @router.get("/usage/stats")
-async def get_usage_statistics(
+def get_usage_statistics(
     days: int = 30,
-    user: User = Depends(get_current_user),
+    user: UserSnapshot = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
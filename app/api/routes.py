@@ -1,4 +1,6 @@
 from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from app.models.schemas import (
     EmailValidationRequest,
@@ -10,17 +12,109 @@ from app.models.schemas import (
 from app.services.validator import email_validator
 from app.services.logger import validation_logger
 from app.services.rate_limiter import rate_limiter
+from app.services.disposable import is_disposable_domain, refresh_disposable_domains
 from app.core.config import settings
 from app.services.orchestrator import orchestrator, to_response
 from app.core.database import get_db
-from app.middleware.auth import optional_api_key, get_current_user
+from app.middleware.auth import optional_api_key, get_current_user, require_admin
 from app.models.database import User
+from app.core.security import UserSnapshot
+import asyncio
+import logging
+import orjson
 import time
 from datetime import datetime
 from typing import Optional
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
+# Máximo de emails validados a la vez en un bulk (limita los sockets SMTP abiertos)
+BULK_CONCURRENCY = 20
+
+
+def _internal_error(message: str, exc: Exception) -> HTTPException:
+    """
+    500 con un mensaje fijo; el detalle de la excepción solo se expone en DEBUG
+    """
+    detail = f"{message}: {exc}" if settings.DEBUG else message
+    return HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail=detail
+    )
+
+
+def _build_response(result: dict, processing_time_ms: float) -> EmailValidationResponse:
+    """
+    Arma la respuesta de la API a partir del dict del validator legacy
+
+    El resultado viene de nuestro propio validator: se omite la validación
+    de campos
+    """
+    return EmailValidationResponse.model_construct(
+        email=result["email"],
+        is_valid=result["is_valid"],
+        syntax_valid=result["syntax_valid"],
+        domain=result["domain"] or "",
+        has_mx_records=result["has_mx_records"],
+        mx_records=result["mx_records"],
+        is_disposable=result["is_disposable"],
+        smtp_check_performed=result["smtp_check_performed"],
+        mailbox_exists=result["mailbox_exists"],
+        smtp_response=result["smtp_response"],
+        is_catch_all=result.get("is_catch_all"),
+        deliverability_score=result["deliverability_score"],
+        processing_time_ms=processing_time_ms
+    )
+
+
+def _error_response(email: str) -> EmailValidationResponse:
+    """
+    Resultado de reemplazo para una entrada del bulk cuya validación falló
+    """
+    return EmailValidationResponse.model_construct(
+        email=email,
+        is_valid=False,
+        syntax_valid=False,
+        domain=email.rpartition("@")[2].lower(),
+        has_mx_records=False,
+        mx_records=None,
+        is_disposable=False,
+        smtp_check_performed=False,
+        mailbox_exists=None,
+        smtp_response=None,
+        is_catch_all=None,
+        deliverability_score=0.0,
+        processing_time_ms=0
+    )
+
+
+async def _resolve_bulk_mx(emails: list[str], semaphore: asyncio.Semaphore) -> dict:
+    """
+    Resultado de check_mx_records para cada dominio distinto de un bulk
+
+    Pasarlos a cada validación evita que un dominio repetido vuelva a
+    consultar el DNS, ni siquiera en los fallos que el cache del validator
+    no guarda (las direcciones mal formadas caen en sintaxis y nunca llegan
+    al DNS)
+    """
+    mx_results = {}
+    
+    async def resolve_mx(domain: str) -> None:
+        async with semaphore:
+            mx_results[domain] = await email_validator.check_mx_records(domain)
+    
+    domains = {
+        email.rpartition("@")[2].lower()
+        for email in emails
+        if email_validator.has_valid_shape(email)
+    }
+    if settings.SKIP_MX_ON_DISPOSABLE:
+        domains = {d for d in domains if not is_disposable_domain(d)}
+    await asyncio.gather(*(resolve_mx(d) for d in domains if d))
+    return mx_results
+
 
 @router.get("/health", response_model=HealthResponse)
 async def health_check():
@@ -53,7 +147,7 @@ async def validate_email(
     
     Returns a deliverability score from 0-100.
     """
-    start_time = time.time()
+    start_time = time.perf_counter()
     
     user_id = None
     api_key_id = None
@@ -66,7 +160,9 @@ async def validate_email(
         api_key_id = api_key.id
         
         # Verificar rate limit
-        can_proceed, quota_info = rate_limiter.check_rate_limit(db, user.id)
+        can_proceed, quota_info = await run_in_threadpool(
+            rate_limiter.check_rate_limit, db, user.id
+        )
         
         if not can_proceed:
             raise HTTPException(
@@ -79,38 +175,29 @@ async def validate_email(
                 }
             )
 
-    USE_ORCHESTRATOR = getattr(settings, "USE_ORCHESTRATOR", True)
-
-    if USE_ORCHESTRATOR:
+    if settings.USE_ORCHESTRATOR:
         try:
             mode = "quick" if not request.check_smtp else getattr(request, "mode", "standard")
             assessment = await orchestrator.assess(request.email, mode=mode)
             payload = to_response(assessment)
-            response = EmailValidationResponse(**payload)
-
-            # logging existente
-            try:
-                validation_logger.log_validation(
-                    db=db,
-                    email=request.email,
-                    validation_result=payload,
-                    processing_time_ms=payload["processing_time_ms"],
-                    user_id=user_id,
-                    api_key_id=api_key_id,
-                )
-            except Exception:
-                pass
+            response = EmailValidationResponse.model_construct(**payload)
+
+            # El log lo escribe en segundo plano el flush por lotes
+            validation_logger.enqueue_validation(
+                email=request.email,
+                validation_result=payload,
+                processing_time_ms=payload["processing_time_ms"],
+                user_id=user_id,
+                api_key_id=api_key_id,
+            )
 
             # incrementar cuota si está autenticado
             if auth:
-                rate_limiter.increment_usage(db, user_id, count=1)
+                await run_in_threadpool(rate_limiter.increment_usage, db, user_id, count=1)
 
             return response
         except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Orchestrator error: {str(e)}",
-            )
+            raise _internal_error("Orchestrator error", e)
     
     try:
         # Perform validation
@@ -120,50 +207,28 @@ async def validate_email(
         )
         
         # Calculate processing time
-        processing_time = (time.time() - start_time) * 1000  # Convert to ms
+        processing_time = (time.perf_counter() - start_time) * 1000  # Convert to ms
         
         # Build response
-        response = EmailValidationResponse(
-            email=result["email"],
-            is_valid=result["is_valid"],
-            syntax_valid=result["syntax_valid"],
-            domain=result["domain"] or "",
-            has_mx_records=result["has_mx_records"],
-            mx_records=result["mx_records"],
-            is_disposable=result["is_disposable"],
-            smtp_check_performed=result["smtp_check_performed"],
-            mailbox_exists=result["mailbox_exists"],
-            smtp_response=result["smtp_response"],
-            is_catch_all=result.get("is_catch_all"),
-            deliverability_score=result["deliverability_score"],
-            processing_time_ms=round(processing_time, 2)
-        )   
-        
-        # Log validation to database
-        try:
-            validation_logger.log_validation(
-                db=db,
-                email=request.email,
-                validation_result=result,
-                processing_time_ms=processing_time,
-                user_id=user_id,
-                api_key_id=api_key_id
-            )
-        except Exception as log_error:
-            # Silently fail if logging doesn't work
-            pass
+        response = _build_response(result, round(processing_time, 2))
+        
+        # Registrar la validación (la escribe en segundo plano el flush por lotes)
+        validation_logger.enqueue_validation(
+            email=request.email,
+            validation_result=result,
+            processing_time_ms=processing_time,
+            user_id=user_id,
+            api_key_id=api_key_id
+        )
         
         # Increment usage counter if authenticated
         if auth:
-            rate_limiter.increment_usage(db, user_id, count=1)
+            await run_in_threadpool(rate_limiter.increment_usage, db, user_id, count=1)
         
         return response
         
     except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Validation error: {str(e)}"
-        )
+        raise _internal_error("Validation error", e)
 
 
 @router.post("/validate/bulk", response_model=BulkValidationResponse)
@@ -180,65 +245,165 @@ async def validate_bulk(request: BulkValidationRequest):
     - Import validation
     - Database cleanup
     """
-    start_time = time.time()
+    start_time = time.perf_counter()
     
-    if len(request.emails) > 100:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Maximum 100 emails allowed per bulk request"
-        )
+    # El tope de 100 emails lo aplica BulkValidationRequest
+    # Las direcciones repetidas comparten una sola validación
+    unique_emails = list(dict.fromkeys(request.emails))
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
     
-    results = []
+    # dominio -> resultado de check_mx_records, compartido por todo el lote
+    mx_results = {}
     
-    try:
-        # Validate each email
-        for email in request.emails:
-            result = await email_validator.validate_email(
+    async def validate_one(email: str) -> dict:
+        async with semaphore:
+            # SMTP corre después para todo el lote, agrupado por host MX
+            return await email_validator.validate_email(
                 email=email,
-                check_smtp=request.check_smtp
-            )
-            
-            response = EmailValidationResponse(
-                email=result["email"],
-                is_valid=result["is_valid"],
-                syntax_valid=result["syntax_valid"],
-                domain=result["domain"] or "",
-                has_mx_records=result["has_mx_records"],
-                mx_records=result["mx_records"],
-                is_disposable=result["is_disposable"],
-                smtp_check_performed=result["smtp_check_performed"],
-                mailbox_exists=result["mailbox_exists"],
-                smtp_response=result["smtp_response"],
-                deliverability_score=result["deliverability_score"],
-                processing_time_ms=0  # Individual timing not tracked in bulk
+                check_smtp=False,
+                mx_results=mx_results
             )
-            
-            results.append(response)
+    
+    try:
+        # Resolver MX una sola vez por dominio
+        mx_results = await _resolve_bulk_mx(unique_emails, semaphore)
+        
+        # Validar en paralelo (MX ya resuelto arriba)
+        # Una dirección que falla (error de resolver/SMTP) no tumba el lote
+        validated = await asyncio.gather(
+            *(validate_one(e) for e in unique_emails),
+            return_exceptions=True
+        )
+        
+        failed = {}
+        completed = {}
+        for email, result in zip(unique_emails, validated):
+            if isinstance(result, Exception):
+                logger.warning(f"Bulk validation failed for {email}: {result}")
+                failed[email] = _error_response(email)
+            else:
+                completed[email] = result
+        
+        # Una sesión SMTP por host MX en vez de una conexión por dirección
+        if request.check_smtp:
+            await email_validator.verify_smtp_batch(list(completed.values()))
+        
+        # Individual timing not tracked in bulk
+        responses = {email: _build_response(result, 0) for email, result in completed.items()}
+        responses.update(failed)
+        results = [responses[email] for email in request.emails]
+        
+        # Una fila de log por dirección validada; el flush por lotes las
+        # escribe con INSERTs multi-row
+        validation_logger.enqueue_validations(list(completed.values()))
         
         # Calculate total processing time
-        total_processing_time = (time.time() - start_time) * 1000
+        total_processing_time = (time.perf_counter() - start_time) * 1000
         
-        return BulkValidationResponse(
+        # Cada entrada se armó con model_construct a partir de resultados
+        # propios: el contenedor también omite la validación
+        payload = BulkValidationResponse.model_construct(
             total_checked=len(results),
             results=results,
             processing_time_ms=round(total_processing_time, 2)
         )
+        # Serializar una sola vez con orjson en vez de que FastAPI la vuelva
+        # a validar contra response_model
+        return ORJSONResponse(content=payload.model_dump())
         
     except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Bulk validation error: {str(e)}"
-        )
+        raise _internal_error("Bulk validation error", e)
+
+
+@router.post("/validate/bulk/stream")
+async def validate_bulk_stream(request: BulkValidationRequest):
+    """
+    Validate multiple email addresses, streaming results as NDJSON
+
+    Same checks and limits as /validate/bulk, but each result is written
+    as one JSON line (application/x-ndjson) as soon as it is final, so
+    clients can show progress instead of waiting for the whole batch.
+
+    - Lines arrive in completion order, not request order
+    - Repeated addresses produce a single line
+    - With check_smtp, results are emitted per MX host once its SMTP
+      session finishes
+    """
+    unique_emails = list(dict.fromkeys(request.emails))
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+    
+    def encode(response: EmailValidationResponse) -> bytes:
+        return orjson.dumps(response.model_dump()) + b"\n"
+    
+    async def generate():
+        mx_results = await _resolve_bulk_mx(unique_emails, semaphore)
+        
+        async def validate_one(email: str) -> tuple[str, object]:
+            async with semaphore:
+                try:
+                    return email, await email_validator.validate_email(
+                        email=email,
+                        check_smtp=False,
+                        mx_results=mx_results
+                    )
+                except Exception as e:
+                    return email, e
+        
+        completed = []
+        for next_done in asyncio.as_completed([validate_one(e) for e in unique_emails]):
+            email, result = await next_done
+            if isinstance(result, Exception):
+                # Una dirección que falla no corta el stream
+                logger.warning(f"Bulk validation failed for {email}: {result}")
+                yield encode(_error_response(email))
+            elif request.check_smtp:
+                completed.append(result)
+            else:
+                validation_logger.enqueue_validations([result])
+                yield encode(_build_response(result, 0))
+        
+        if completed:
+            async for group in email_validator.iter_smtp_batch(completed):
+                validation_logger.enqueue_validations(group)
+                for result in group:
+                    yield encode(_build_response(result, 0))
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@router.post("/admin/refresh-disposable", dependencies=[Depends(require_admin)])
+async def refresh_disposable():
+    """
+    Reload the in-memory disposable domain set from the DisposableDomain table
+
+    Call after adding or removing rows; validations pick up the new set
+    immediately.
+
+    **Authentication:** `X-Admin-Token` header matching `ADMIN_TOKEN`
+    (disabled when unset)
+    """
+    try:
+        count, version = await refresh_disposable_domains()
+    except Exception as e:
+        raise _internal_error("Disposable domains refresh error", e)
+    
+    return {"domains": count, "version": version}
 
 
 @router.get("/stats")
-async def get_stats():
+async def get_stats(
+    user: UserSnapshot = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
     """
-    Get API statistics and usage information
+    Get validation statistics for the authenticated user
+    
+    Aggregates over the user's logged validations: counts, valid and
+    disposable totals, and average deliverability score.
     
-    TODO: Implement after database setup
+    **Authentication:** Required
     """
-    return {
-        "message": "Statistics endpoint - Coming soon",
-        "info": "Will track validation counts, success rates, etc."
-    }
+    try:
+        return await run_in_threadpool(validation_logger.get_stats_by_user, db, user.id)
+    except Exception as e:
+        raise _internal_error("Stats error", e)
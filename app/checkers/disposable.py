@@ -1,15 +1,14 @@
 """
-Checker de dominios desechables. Envuelve la lista existente de
-EmailValidatorService.DISPOSABLE_DOMAINS.
+Checker de dominios desechables. Consulta el conjunto en memoria de
+app.services.disposable (lista curada + tabla DisposableDomain).
 
 Semantica: PASS = NO es desechable (senal positiva).
            FAIL = es desechable.
-
-Nota futura: cargar/expandir desde la tabla DisposableDomain de la DB.
 """
 
 from app.checkers.base import Checker, CheckContext
 from app.core.results import CheckResult, CheckStatus
+from app.services.disposable import is_disposable_domain
 
 
 class DisposableChecker(Checker):
@@ -17,18 +16,8 @@ class DisposableChecker(Checker):
     weight = 20
     cost = "fast"
 
-    # Misma lista curada del validator.py original
-    DISPOSABLE_DOMAINS: set[str] = {
-        "tempmail.com", "throwaway.email", "guerrillamail.com",
-        "10minutemail.com", "mailinator.com", "maildrop.cc",
-        "temp-mail.org", "getnada.com", "trashmail.com",
-        "yopmail.com", "sharklasers.com", "guerrillamail.info",
-        "grr.la", "guerrillamail.biz", "guerrillamail.de",
-        "spam4.me", "getairmail.com", "fakeinbox.com",
-    }
-
     async def run(self, ctx: CheckContext) -> CheckResult:
-        if ctx.domain in self.DISPOSABLE_DOMAINS:
+        if is_disposable_domain(ctx.domain):
             return CheckResult(
                 name=self.name,
                 status=CheckStatus.FAIL,
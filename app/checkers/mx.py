@@ -1,44 +1,143 @@
 """
-Checker de registros MX. Envuelve la logica existente de check_mx_records()
-en EmailValidatorService (dnspython en executor para no bloquear).
+Checker de registros MX. Misma logica que check_mx_records() en
+EmailValidatorService, con el resolver asincrono de dnspython (no bloquea
+el event loop ni ocupa hilos del executor).
+
+Si el dominio no publica MX pero si A/AAAA, se usa el propio dominio como
+MX implicito (RFC 5321, 5.1): asi entregan los servidores SMTP reales.
 """
 
 import asyncio
+from operator import itemgetter
 
+import dns.asyncresolver
 import dns.resolver
 
 from app.checkers.base import Checker, CheckContext
 from app.core.results import CheckResult, CheckStatus
+from app.core.config import settings
 from app.models.schemas import MXRecord
 
 
+async def resolve_implicit_mx(
+    resolver: dns.asyncresolver.Resolver, domain: str
+) -> list[MXRecord]:
+    """
+    MX implicito para un dominio sin registros MX: [domain] si tiene A o
+    AAAA, [] si no. Solo tiene sentido tras un NoAnswer (el dominio existe).
+    """
+    for rdtype in ("A", "AAAA"):
+        try:
+            await resolver.resolve(domain, rdtype)
+            return [MXRecord(host=domain, priority=0)]
+        except (dns.resolver.NoAnswer, dns.resolver.NXDOMAIN):
+            continue
+    return []
+
+
+class BoundedResolver(dns.asyncresolver.Resolver):
+    """
+    Resolver asincrono con tope de consultas en vuelo, compartido por todos
+    los resolvers de la app: un bulk grande no agota los sockets UDP
+    """
+
+    _semaphore = asyncio.Semaphore(settings.DNS_MAX_CONCURRENCY)
+
+    async def resolve(self, *args, **kwargs):
+        async with self._semaphore:
+            return await super().resolve(*args, **kwargs)
+
+
+class HedgedResolver(BoundedResolver):
+    """
+    Envia cada consulta a todos los nameservers a la vez y se queda con la
+    primera respuesta; un resolver lento o caido no llega al timeout
+
+    NXDOMAIN / NoAnswer son respuestas (el dominio no tiene el registro);
+    solo los errores (timeout, SERVFAIL) esperan al resto de las replicas.
+    """
+
+    def __init__(self, nameservers: list[str]):
+        super().__init__(configure=False)
+        self.nameservers = list(nameservers)
+        self._replicas = []
+        for nameserver in self.nameservers:
+            replica = dns.asyncresolver.Resolver(configure=False)
+            replica.nameservers = [nameserver]
+            self._replicas.append(_configure(replica))
+
+    async def resolve(self, *args, **kwargs):
+        async with self._semaphore:
+            pending = set()
+            for replica in self._replicas:
+                task = asyncio.create_task(replica.resolve(*args, **kwargs))
+                # Las respuestas perdedoras (o que terminan pese a cancel())
+                # se descartan sin el aviso de excepcion no leida
+                task.add_done_callback(_discard_result)
+                pending.add(task)
+            error = None
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        exc = task.exception()
+                        if exc is None or isinstance(
+                            exc, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)
+                        ):
+                            return task.result()
+                        error = exc
+            finally:
+                for task in pending:
+                    task.cancel()
+            raise error
+
+
+def _discard_result(task: asyncio.Task) -> None:
+    if not task.cancelled():
+        task.exception()
+
+
+def _configure(resolver: dns.asyncresolver.Resolver) -> dns.asyncresolver.Resolver:
+    # timeout por servidor, lifetime para la consulta completa
+    resolver.timeout = settings.DNS_TIMEOUT
+    resolver.lifetime = settings.DNS_LIFETIME
+    return resolver
+
+
+def build_resolver() -> dns.asyncresolver.Resolver:
+    if settings.DNS_HEDGE_NAMESERVERS:
+        return _configure(HedgedResolver(settings.DNS_HEDGE_NAMESERVERS))
+    return _configure(BoundedResolver())
+
+
 class MXChecker(Checker):
     name = "mx"
     weight = 30
     cost = "fast"
 
     def __init__(self):
-        self.resolver = dns.resolver.Resolver()
-        self.resolver.timeout = 5
-        self.resolver.lifetime = 5
+        self.resolver = build_resolver()
 
     async def run(self, ctx: CheckContext) -> CheckResult:
         try:
-            loop = asyncio.get_event_loop()
-            answers = await loop.run_in_executor(
-                None,
-                lambda: self.resolver.resolve(ctx.domain, "MX"),
-            )
-            records = sorted(
-                (
-                    MXRecord(
-                        host=str(r.exchange).rstrip("."),
-                        priority=r.preference,
-                    )
-                    for r in answers
-                ),
-                key=lambda x: x.priority,
-            )
+            ttl = None
+            try:
+                answers = await self.resolver.resolve(ctx.domain, "MX")
+                # TTL del registro: el orquestador no cachea mas alla de el
+                ttl = answers.rrset.ttl
+                # Tuplas para ordenar; modelos sin validacion (datos propios)
+                pairs = sorted(
+                    ((str(r.exchange).rstrip("."), int(r.preference)) for r in answers),
+                    key=itemgetter(1),
+                )
+                records = [
+                    MXRecord.model_construct(host=host, priority=priority)
+                    for host, priority in pairs
+                ]
+            except dns.resolver.NoAnswer:
+                records = await resolve_implicit_mx(self.resolver, ctx.domain)
             if records:
                 # Compartir para que el checker SMTP no repita la consulta
                 ctx.shared["mx_records"] = records
@@ -46,13 +145,13 @@ class MXChecker(Checker):
                     name=self.name,
                     status=CheckStatus.PASS,
                     weight=self.weight,
-                    detail={"records": records},
+                    detail={"records": records, "ttl": ttl},
                 )
             return CheckResult(
                 name=self.name,
                 status=CheckStatus.FAIL,
                 weight=self.weight,
-                note="El dominio no tiene registros MX",
+                note="El dominio no tiene registros MX ni A/AAAA",
             )
         except (
             dns.resolver.NXDOMAIN,
@@ -22,14 +22,14 @@ class RoleAccountChecker(Checker):
     weight = 10
     cost = "fast"
 
-    ROLE_LOCALPARTS: set[str] = {
+    ROLE_LOCALPARTS: frozenset[str] = frozenset({
         "admin", "administrator", "info", "contact", "contacto",
         "support", "soporte", "help", "sales", "ventas",
         "noreply", "no-reply", "no_reply", "donotreply",
         "postmaster", "webmaster", "hostmaster", "abuse",
         "billing", "marketing", "office", "hr", "jobs", "careers",
         "hello", "hola", "team", "mail", "email", "newsletter",
-    }
+    })
 
     async def run(self, ctx: CheckContext) -> CheckResult:
         local = ctx.email.split("@")[0].lower()
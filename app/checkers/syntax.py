@@ -1,32 +1,49 @@
 """
 Checker de sintaxis. Envuelve la logica existente de validate_syntax()
 en EmailValidatorService (email-validator, RFC-compliant).
+
+parse_email() cachea el parseo por direccion: es deterministico y es lo
+mas caro del camino sin red (IDNA, normalizacion). Lo comparten el
+checker y EmailValidatorService.
 """
 
+from functools import lru_cache
+from typing import Optional
+
 from email_validator import validate_email, EmailNotValidError
 
 from app.checkers.base import Checker, CheckContext
 from app.core.results import CheckResult, CheckStatus
 
 
+@lru_cache(maxsize=100_000)
+def parse_email(email: str) -> tuple[Optional[str], Optional[str]]:
+    """
+    (email normalizado, None) si es valido; (None, motivo) si no
+    """
+    try:
+        return validate_email(email, check_deliverability=False).normalized, None
+    except EmailNotValidError as e:
+        return None, str(e)
+
+
 class SyntaxChecker(Checker):
     name = "syntax"
     weight = 20
     cost = "fast"
 
     async def run(self, ctx: CheckContext) -> CheckResult:
-        try:
-            validated = validate_email(ctx.email, check_deliverability=False)
+        normalized, error = parse_email(ctx.email)
+        if normalized is not None:
             return CheckResult(
                 name=self.name,
                 status=CheckStatus.PASS,
                 weight=self.weight,
-                detail={"normalized": validated.normalized},
-            )
-        except EmailNotValidError as e:
-            return CheckResult(
-                name=self.name,
-                status=CheckStatus.FAIL,
-                weight=self.weight,
-                note=str(e),
+                detail={"normalized": normalized},
             )
+        return CheckResult(
+            name=self.name,
+            status=CheckStatus.FAIL,
+            weight=self.weight,
+            note=error,
+        )
@@ -1,8 +1,7 @@
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 from typing import Optional
 
-from sqlalchemy import true
-
 
 class Settings(BaseSettings):
     # App
@@ -12,6 +11,9 @@ class Settings(BaseSettings):
     
     # Database (opcional por ahora - se usará en Fase 2)
     DATABASE_URL: Optional[str] = None
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_RECYCLE: int = 3600  # segundos
     
     # API
     API_V1_PREFIX: str = "/api/v1"
@@ -24,15 +26,48 @@ class Settings(BaseSettings):
     RATE_LIMIT_BASIC: int = 5000
     RATE_LIMIT_PRO: int = 50000
     
+    # Redis (opcional): contadores de cuota compartidos entre workers/replicas
+    REDIS_URL: Optional[str] = None
+    QUOTA_SYNC_INTERVAL: int = 30  # segundos entre snapshots Redis -> DB
+    USAGE_FLUSH_INTERVAL: float = 0.5  # segundos entre flush de contadores en memoria
+    LOG_FLUSH_INTERVAL: float = 1.0  # segundos entre escrituras en lote de validation_logs
+    
+    # DNS (MX y fallback A/AAAA)
+    DNS_TIMEOUT: float = 2.0  # segundos por servidor
+    DNS_LIFETIME: float = 3.0  # segundos por consulta completa (reintentos incluidos)
+    DNS_MAX_CONCURRENCY: int = 256  # consultas DNS en vuelo (toda la app)
+    # Nameservers a consultar en paralelo (gana el primero); vacio = resolv.conf
+    DNS_HEDGE_NAMESERVERS: list[str] = []
+    # MX resueltos al arrancar (proveedores mas comunes); vacio = sin warmup
+    MX_WARMUP_DOMAINS: list[str] = [
+        "gmail.com", "outlook.com", "hotmail.com", "yahoo.com", "icloud.com",
+    ]
+    
+    # Lista de dominios desechables (uno por linea); None = la empaquetada
+    DISPOSABLE_DOMAINS_FILE: Optional[str] = None
+    # Sumar la blocklist del paquete disposable-email-domains (~3.5k dominios)
+    DISPOSABLE_INCLUDE_PACKAGE_LIST: bool = False
+    # Saltar la consulta MX de un dominio desechable (pierde el credito MX del score)
+    SKIP_MX_ON_DISPOSABLE: bool = False
+    # Saltar SMTP para un dominio desechable (SMTP deja de contar en el score)
+    SKIP_SMTP_ON_DISPOSABLE: bool = False
+    
     # SMTP Validation
     SMTP_TIMEOUT: int = 10
     SMTP_FROM_EMAIL: str = "verify@yourdomain.com"
+    SMTP_MAX_CONCURRENCY: int = 64  # sesiones SMTP simultaneas
+    SMTP_HEDGE_DELAY: float = 3.0  # segundos sin respuesta del MX antes de probar el siguiente
+    SMTP_HELO_HOSTNAME: Optional[str] = None  # idealmente coincide con el PTR de la IP de salida
     
     # Security
     SECRET_KEY: str = "your-secret-key-change-this-in-production"
+    # SECRET_KEY anterior tras una rotacion: las keys se rehashean al usarse
+    SECRET_KEY_PREVIOUS: Optional[str] = None
+    ALLOW_QUERY_API_KEY: bool = True  # ?api_key=... (testing); desactivar en producción
+    ADMIN_TOKEN: Optional[str] = None  # header X-Admin-Token de /admin/*; sin definir = deshabilitados
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
-    USE_ORCHESTRATOR=true
+    USE_ORCHESTRATOR: bool = True
 
     class Config:
         env_file = ".env"
@@ -42,4 +77,14 @@ class Settings(BaseSettings):
         extra = "ignore"
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Settings construidos una sola vez por proceso (lee .env y valida tipos)
+    
+    Usar como dependency: settings: Settings = Depends(get_settings)
+    """
+    return Settings()
+
+
+settings = get_settings()
@@ -2,6 +2,8 @@
 Database connection and session management
 """
 
+from contextlib import contextmanager
+
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -21,11 +23,22 @@ else:
     # Usar SQLite para desarrollo local sin PostgreSQL
     SQLALCHEMY_DATABASE_URL = "sqlite:///./email_validator.db"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    # Para SQLite
-    connect_args={"check_same_thread": False} if "sqlite" in SQLALCHEMY_DATABASE_URL else {}
-)
+if "sqlite" in SQLALCHEMY_DATABASE_URL:
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False}
+    )
+else:
+    # Pool explícito: el default (5 + 10 overflow) se agota con ~100 requests
+    # concurrentes. pre_ping descarta conexiones muertas (PgBouncer, reinicios)
+    # y recycle evita que el servidor las cierre por inactividad.
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_pre_ping=True,
+        pool_recycle=settings.DB_POOL_RECYCLE
+    )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -44,6 +57,24 @@ def get_db():
         db.close()
 
 
+@contextmanager
+def session_scope():
+    """
+    Sesión para código fuera de un request (tareas en background)
+    
+    Hace commit al salir sin errores y rollback si hubo excepción.
+    """
+    db = SessionLocal()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
 def init_db():
     """
     Inicializa la base de datos creando todas las tablas
@@ -0,0 +1,40 @@
+"""
+Logging estructurado (una linea JSON por evento) para el logger "app".
+
+Reemplaza los print() de arranque/errores: logging serializa las escrituras
+con su propio lock y cada linea se puede parsear en Railway/Render.
+"""
+
+import logging
+import sys
+
+import orjson
+
+from app.core.config import settings
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        # orjson ya escribe UTF-8 sin escapar (como ensure_ascii=False)
+        return orjson.dumps(entry).decode()
+
+
+def setup_logging() -> None:
+    logger = logging.getLogger("app")
+    if logger.handlers:
+        # Ya configurado (reload de uvicorn, imports repetidos)
+        return
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG if settings.DEBUG else logging.INFO)
+    logger.propagate = False
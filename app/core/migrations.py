@@ -0,0 +1,78 @@
+"""
+Migraciones de esquema que create_all no cubre
+
+create_all crea las tablas que faltan pero nunca altera una existente. Lo
+que cambia columnas de una tabla ya desplegada se migra aqui, al arrancar,
+de forma idempotente: cada paso revisa el esquema real antes de tocarlo.
+
+api_keys: el esquema original guardaba la key en texto plano (columna
+key). El actual guarda solo key_hash (hash_api_key) y key_preview. La
+migracion agrega las columnas nuevas, las llena a partir de la key en
+texto plano y despues elimina la columna key; las keys ya emitidas siguen
+funcionando sin reemitirlas.
+
+Los hashes que no son el actual (SHA-256 simple, de antes del HMAC, o HMAC
+con una SECRET_KEY rotada) no se migran aqui: no se puede sin la key en
+texto plano. ApiKeyManager.get_api_key los acepta y rehashea la fila en
+el primer uso.
+"""
+
+import logging
+
+from sqlalchemy import inspect, text
+
+from app.core.database import engine
+from app.core.security import SecurityManager
+
+logger = logging.getLogger(__name__)
+
+
+def migrate_plaintext_api_keys() -> int:
+    """
+    Pasa api_keys del esquema con key en texto plano al de key_hash
+    (bloqueante; una sola transaccion)
+
+    Returns:
+        Cantidad de keys migradas (0 si el esquema ya estaba al dia)
+    """
+    insp = inspect(engine)
+    if not insp.has_table("api_keys"):
+        return 0
+    columns = {c["name"] for c in insp.get_columns("api_keys")}
+    if "key" not in columns:
+        return 0
+
+    with engine.begin() as conn:
+        if "key_hash" not in columns:
+            conn.execute(text("ALTER TABLE api_keys ADD COLUMN key_hash CHAR(64)"))
+        if "key_preview" not in columns:
+            conn.execute(text("ALTER TABLE api_keys ADD COLUMN key_preview VARCHAR(24)"))
+
+        rows = conn.execute(text("SELECT id, key FROM api_keys")).all()
+        if rows:
+            conn.execute(
+                text("UPDATE api_keys SET key_hash = :h, key_preview = :p WHERE id = :kid"),
+                [
+                    {
+                        "kid": key_id,
+                        "h": SecurityManager.hash_api_key(key),
+                        "p": SecurityManager.key_preview(key),
+                    }
+                    for key_id, key in rows
+                ],
+            )
+
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_api_keys_key_hash ON api_keys (key_hash)"
+        ))
+        if conn.dialect.name == "postgresql":
+            conn.execute(text(
+                "ALTER TABLE api_keys ALTER COLUMN key_hash SET NOT NULL, "
+                "ALTER COLUMN key_preview SET NOT NULL"
+            ))
+        # SQLite no elimina una columna que tiene indice propio
+        conn.execute(text("DROP INDEX IF EXISTS ix_api_keys_key"))
+        conn.execute(text("ALTER TABLE api_keys DROP COLUMN key"))
+
+    logger.info(f"api_keys migrated to hashed keys: {len(rows)} keys")
+    return len(rows)
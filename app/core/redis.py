@@ -0,0 +1,25 @@
+"""
+Cliente Redis compartido (opcional).
+
+Si REDIS_URL no esta configurado, get_redis() devuelve None y cada servicio
+sigue con su camino en DB / en memoria. Con varias replicas o workers,
+Redis es lo que mantiene los contadores consistentes entre procesos.
+"""
+
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    import redis
+
+
+@lru_cache(maxsize=1)
+def get_redis() -> Optional["redis.Redis"]:
+    if not settings.REDIS_URL:
+        return None
+
+    import redis
+
+    return redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
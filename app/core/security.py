@@ -2,12 +2,76 @@
 Security utilities for API key generation and validation
 """
 
-import secrets
+import base64
+import os
+import re
 import hashlib
-from datetime import datetime, timedelta
+import hmac
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Tuple
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, case, or_, update
+from sqlalchemy.orm import Session, joinedload
+from app.core.config import settings
+from app.core.database import session_scope
 from app.models.database import ApiKey, User
+from app.services.cache import api_key_cache
+
+_LIVE_PREFIX = "ev_live_"
+_TEST_PREFIX = "ev_test_"
+
+# Prefijo + 24 bytes aleatorios en base64 url-safe (32 chars; se admite hasta 64)
+_KEY_FORMAT_RE = re.compile(r"ev_(?:live|test)_[A-Za-z0-9_-]{32,64}")
+
+# Clave del HMAC de API keys, codificada una sola vez
+_HMAC_KEY = settings.SECRET_KEY.encode()
+# Clave anterior (rotación de SECRET_KEY), solo para encontrar hashes viejos
+_PREVIOUS_HMAC_KEY = settings.SECRET_KEY_PREVIOUS.encode() if settings.SECRET_KEY_PREVIOUS else None
+
+# Usos de API keys pendientes de escribir: key_id -> [requests, last_used_at]
+_pending_key_usage: dict[int, list] = {}
+_pending_key_lock = threading.Lock()
+
+
+@dataclass(slots=True)
+class UserSnapshot:
+    """
+    Copia de User que viaja en el cache de autenticación
+    
+    Atributos planos, sin instrumentación de SQLAlchemy ni sesión asociada:
+    acceder a ellos nunca dispara un lazy load. Los cambios en DB van por
+    su propio UPDATE, no a través de este objeto.
+    """
+    id: int
+    email: str
+    username: Optional[str]
+    plan: str
+    monthly_quota: int
+    validations_used: int
+    is_active: bool
+    created_at: Optional[datetime]
+
+
+@dataclass(slots=True)
+class ApiKeySnapshot:
+    """
+    Copia de ApiKey para el cache de autenticación (ver UserSnapshot)
+    """
+    id: int
+    name: Optional[str]
+    key_preview: str
+    user_id: int
+    is_active: bool
+    created_at: Optional[datetime]
+    expires_at: Optional[datetime]
+    last_used_at: Optional[datetime]
+    total_requests: int
+
+
+def _snapshot(cls, obj):
+    return cls(*(getattr(obj, field) for field in cls.__slots__))
 
 
 class SecurityManager:
@@ -15,6 +79,13 @@ class SecurityManager:
     Maneja la generación y validación de API keys
     """
     
+    @staticmethod
+    def _random_part() -> str:
+        """
+        24 bytes de os.urandom en base64 url-safe: 32 caracteres, sin padding
+        """
+        return base64.urlsafe_b64encode(os.urandom(24)).decode("ascii")
+    
     @staticmethod
     def generate_api_key() -> str:
         """
@@ -23,8 +94,7 @@ class SecurityManager:
         Formato: ev_live_xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx (32 chars random)
         Prefijo 'ev' = Email Validator
         """
-        random_part = secrets.token_urlsafe(24)  # 32 caracteres base64
-        return f"ev_live_{random_part}"
+        return _LIVE_PREFIX + SecurityManager._random_part()
     
     @staticmethod
     def generate_test_api_key() -> str:
@@ -33,18 +103,44 @@ class SecurityManager:
         
         Formato: ev_test_xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
         """
-        random_part = secrets.token_urlsafe(24)
-        return f"ev_test_{random_part}"
+        return _TEST_PREFIX + SecurityManager._random_part()
     
     @staticmethod
     def hash_api_key(api_key: str) -> str:
         """
         Hash de API key para almacenamiento seguro
         
-        Nota: Por simplicidad, guardamos la key en texto plano
-        En producción seria, hashearla con bcrypt o argon2
+        Es lo único que se persiste de la key (columna key_hash).
+        HMAC-SHA256 con SECRET_KEY: las keys ya son aleatorias de alta
+        entropía, no necesitan un KDF lento, y sin el secreto un dump de la
+        tabla no sirve para probar keys. Al rotar SECRET_KEY, la anterior
+        va en SECRET_KEY_PREVIOUS (ver legacy_key_hashes).
         """
-        return hashlib.sha256(api_key.encode()).hexdigest()
+        return hmac.new(_HMAC_KEY, api_key.encode(), hashlib.sha256).hexdigest()
+    
+    @staticmethod
+    def legacy_key_hashes(api_key: str) -> list:
+        """
+        Hashes con los que una key pudo quedar guardada antes: SHA-256
+        simple (antes del HMAC) y HMAC con SECRET_KEY_PREVIOUS
+        
+        get_api_key los acepta y reescribe la fila con hash_api_key.
+        """
+        hashes = [hashlib.sha256(api_key.encode()).hexdigest()]
+        if _PREVIOUS_HMAC_KEY:
+            hashes.append(
+                hmac.new(_PREVIOUS_HMAC_KEY, api_key.encode(), hashlib.sha256).hexdigest()
+            )
+        return hashes
+    
+    @staticmethod
+    def key_preview(api_key: str) -> str:
+        """
+        Versión parcial de la key para listados (ev_live_xxx...xxx)
+        """
+        if len(api_key) <= 20:
+            return api_key
+        return f"{api_key[:15]}...{api_key[-4:]}"
     
     @staticmethod
     def validate_api_key_format(api_key: str) -> bool:
@@ -53,21 +149,14 @@ class SecurityManager:
         
         Debe empezar con ev_live_ o ev_test_ y tener longitud apropiada
         """
-        if not api_key:
-            return False
-        
-        if api_key.startswith("ev_live_") or api_key.startswith("ev_test_"):
-            # Verificar longitud mínima
-            return len(api_key) >= 40
-        
-        return False
+        return bool(api_key) and _KEY_FORMAT_RE.fullmatch(api_key) is not None
     
     @staticmethod
     def is_test_key(api_key: str) -> bool:
         """
         Determina si es una key de testing
         """
-        return api_key.startswith("ev_test_")
+        return api_key[:8] == _TEST_PREFIX
 
 
 class ApiKeyManager:
@@ -102,9 +191,11 @@ class ApiKeyManager:
         if expires_days:
             expires_at = datetime.utcnow() + timedelta(days=expires_days)
         
-        # Crear registro
+        # Crear registro (sin la key en texto plano)
+        key_hash = SecurityManager.hash_api_key(plain_key)
         api_key = ApiKey(
-            key=plain_key,  # En producción, guardar hasheada
+            key_hash=key_hash,
+            key_preview=SecurityManager.key_preview(plain_key),
             name=name,
             user_id=user_id,
             is_active=True,
@@ -115,33 +206,86 @@ class ApiKeyManager:
         db.commit()
         db.refresh(api_key)
         
+        # Pre-calentar el cache de autenticacion: el primer request con
+        # la key nueva no tiene que ir a la DB
+        user = db.query(User).filter(User.id == user_id).first()
+        if user:
+            api_key_cache.set(key_hash, ApiKeyManager.cache_entry(api_key, user))
+        
         return api_key, plain_key
     
     @staticmethod
-    def get_api_key(db: Session, key: str) -> Optional[ApiKey]:
+    def cache_entry(
+        api_key: ApiKey,
+        user: User
+    ) -> Tuple[ApiKeySnapshot, UserSnapshot, Optional[float]]:
+        """
+        Entrada de api_key_cache: (ApiKeySnapshot, UserSnapshot, expiración en epoch)
+        
+        Los snapshots desacoplan el cache de la sesión (no hace falta
+        expunge). La expiración se precalcula como epoch para que cada hit
+        compare contra time.time() sin construir un datetime.
+        """
+        expires_ts = ApiKeyManager.expires_ts(api_key.expires_at)
+        return _snapshot(ApiKeySnapshot, api_key), _snapshot(UserSnapshot, user), expires_ts
+    
+    @staticmethod
+    def expires_ts(expires_at: Optional[datetime]) -> Optional[float]:
+        """
+        expires_at como epoch (None = no expira)
+        
+        Se escribe como UTC naive (datetime.utcnow); Postgres lo devuelve
+        con tz, SQLite sin ella. Como epoch ambos se comparan igual.
+        """
+        if not expires_at:
+            return None
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        return expires_at.timestamp()
+    
+    @staticmethod
+    def get_api_key(db: Session, key: str, key_hash: Optional[str] = None) -> Optional[ApiKey]:
         """
         Obtiene una API key de la base de datos
         
         Args:
             db: Database session
             key: API key (plain text)
+            key_hash: hash_api_key(key) si el caller ya lo calculó
             
         Returns:
-            ApiKey object o None
+            ApiKey object o None (con .user ya cargado)
         """
-        return db.query(ApiKey).filter(
-            ApiKey.key == key,
+        if key_hash is None:
+            key_hash = SecurityManager.hash_api_key(key)
+        
+        # Un solo SELECT con JOIN trae la key y su usuario; también busca
+        # los hashes viejos (antes del HMAC o de rotar SECRET_KEY)
+        api_key = db.query(ApiKey).options(joinedload(ApiKey.user)).filter(
+            ApiKey.key_hash.in_([key_hash, *SecurityManager.legacy_key_hashes(key)]),
             ApiKey.is_active == True
         ).first()
+        
+        if api_key is not None and api_key.key_hash != key_hash:
+            # Hash viejo: rehashear la fila en el primer uso
+            api_key.key_hash = key_hash
+            db.commit()
+        
+        return api_key
     
     @staticmethod
-    def validate_api_key(db: Session, key: str) -> Tuple[bool, Optional[ApiKey], Optional[User]]:
+    def validate_api_key(
+        db: Session,
+        key: str,
+        key_hash: Optional[str] = None
+    ) -> Tuple[bool, Optional[ApiKey], Optional[User]]:
         """
         Valida una API key completa
         
         Args:
             db: Database session
             key: API key a validar
+            key_hash: hash_api_key(key) si el caller ya lo calculó
             
         Returns:
             (is_valid, api_key_object, user_object)
@@ -151,63 +295,156 @@ class ApiKeyManager:
             return False, None, None
         
         # Buscar en DB
-        api_key = ApiKeyManager.get_api_key(db, key)
+        api_key = ApiKeyManager.get_api_key(db, key, key_hash)
         
         if not api_key:
             return False, None, None
         
-        # Verificar expiración
-        if api_key.expires_at and api_key.expires_at < datetime.utcnow():
+        # Verificar expiración (misma conversión que el cache)
+        expires_ts = ApiKeyManager.expires_ts(api_key.expires_at)
+        if expires_ts is not None and expires_ts < time.time():
             return False, api_key, None
         
-        # Obtener usuario
-        user = db.query(User).filter(User.id == api_key.user_id).first()
+        # Usuario cargado en el mismo SELECT (joinedload)
+        user = api_key.user
         
         if not user or not user.is_active:
             return False, api_key, None
         
-        # Actualizar último uso
-        api_key.last_used_at = datetime.utcnow()
-        api_key.total_requests += 1
-        db.commit()
-        
+        # El uso lo registra el caller con record_usage (sin escribir aquí)
         return True, api_key, user
     
     @staticmethod
-    def revoke_api_key(db: Session, key_id: int) -> bool:
+    def revoke_api_key(db: Session, key_id: int, user_id: Optional[int] = None) -> bool:
         """
         Revoca (desactiva) una API key
         
+        Un solo UPDATE ... RETURNING: no hidrata la fila y, si se pasa
+        user_id, verifica la pertenencia en la misma sentencia.
+        
         Args:
             db: Database session
             key_id: ID de la key
+            user_id: Si se indica, solo revoca si la key es de este usuario
             
         Returns:
             True si se revocó, False si no existe
         """
-        api_key = db.query(ApiKey).filter(ApiKey.id == key_id).first()
+        stmt = update(ApiKey).where(ApiKey.id == key_id)
+        if user_id is not None:
+            stmt = stmt.where(ApiKey.user_id == user_id)
         
-        if not api_key:
+        revoked = db.execute(
+            stmt.values(is_active=False).returning(ApiKey.key_hash)
+        ).scalar_one_or_none()
+        db.commit()
+        
+        if revoked is None:
             return False
         
-        api_key.is_active = False
-        db.commit()
+        # La key deja de funcionar de inmediato en este proceso
+        api_key_cache.pop(revoked)
         
         return True
     
     @staticmethod
-    def list_user_keys(db: Session, user_id: int) -> list[ApiKey]:
+    def record_usage(key_id: int) -> datetime:
+        """
+        Registra un uso de la key en memoria, sin tocar la DB
+        
+        flush_pending_usage escribe los acumulados en lote.
+        
+        Args:
+            key_id: ID de la key
+            
+        Returns:
+            Timestamp registrado como last_used_at
+        """
+        now = datetime.utcnow()
+        with _pending_key_lock:
+            entry = _pending_key_usage.get(key_id)
+            if entry:
+                entry[0] += 1
+                entry[1] = now
+            else:
+                _pending_key_usage[key_id] = [1, now]
+        
+        return now
+    
+    @staticmethod
+    def flush_pending_usage() -> None:
+        """
+        Escribe last_used_at / total_requests acumulados con un solo
+        executemany (una fila por key)
+        """
+        global _pending_key_usage
+        with _pending_key_lock:
+            if not _pending_key_usage:
+                return
+            pending = _pending_key_usage
+            _pending_key_usage = {}
+        
+        # Deltas aditivos: con varios workers cada uno suma lo suyo sin
+        # pisar a los demás, y last_used_at nunca retrocede
+        table = ApiKey.__table__
+        ts = bindparam("ts")
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("kid"))
+            .values(
+                last_used_at=case(
+                    (or_(table.c.last_used_at.is_(None), table.c.last_used_at < ts), ts),
+                    else_=table.c.last_used_at,
+                ),
+                total_requests=table.c.total_requests + bindparam("n"),
+            )
+        )
+        rows = [
+            {"kid": key_id, "n": n, "ts": ts}
+            for key_id, (n, ts) in pending.items()
+        ]
+        
+        try:
+            with session_scope() as db:
+                db.execute(stmt, rows)
+        except Exception:
+            # Devolver al buffer para el próximo intento, sumando a lo que
+            # se haya acumulado mientras tanto
+            with _pending_key_lock:
+                for key_id, (n, ts) in pending.items():
+                    entry = _pending_key_usage.get(key_id)
+                    if entry:
+                        entry[0] += n
+                        entry[1] = max(entry[1], ts)
+                    else:
+                        _pending_key_usage[key_id] = [n, ts]
+            raise
+    
+    @staticmethod
+    def list_user_keys(db: Session, user_id: int) -> list:
         """
         Lista todas las API keys de un usuario
         
+        Solo selecciona las columnas que se muestran; no hidrata objetos ORM.
+        
         Args:
             db: Database session
             user_id: ID del usuario
             
         Returns:
-            Lista de ApiKey objects
+            Lista de filas (id, name, key_preview, is_active, created_at,
+            expires_at, last_used_at, total_requests)
         """
-        return db.query(ApiKey).filter(
+        return db.query(
+            ApiKey.id,
+            ApiKey.name,
+            ApiKey.key_preview,
+            ApiKey.is_active,
+            ApiKey.created_at,
+            ApiKey.expires_at,
+            ApiKey.last_used_at,
+            ApiKey.total_requests,
+        ).filter(
             ApiKey.user_id == user_id
         ).order_by(ApiKey.created_at.desc()).all()
 
@@ -1,9 +1,26 @@
+import asyncio
+import logging
+from typing import Optional
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from app.api.routes import router
 from app.api.auth import router as auth_router
 from app.core.config import settings
 from app.core.database import init_db
+from app.core.logging_config import setup_logging
+from app.core.migrations import migrate_plaintext_api_keys
+from app.core.security import api_key_manager
+from app.services.background import PeriodicTask
+from app.services.disposable import refresh_disposable_domains
+from app.services.logger import validation_logger
+from app.services.orchestrator import orchestrator
+from app.services.rate_limiter import rate_limiter, sync_usage_to_db
+from app.services.smtp_validator import smtp_validator
+from app.services.validator import email_validator
+
+setup_logging()
+logger = logging.getLogger(__name__)
 
 # Create FastAPI app
 app = FastAPI(
@@ -40,9 +57,40 @@ app = FastAPI(
     """,
     docs_url="/docs",
     redoc_url="/redoc",
-    openapi_url="/openapi.json"
+    openapi_url="/openapi.json",
+    default_response_class=ORJSONResponse
 )
 
+# Snapshot periódico de contadores Redis -> DB (no-op sin REDIS_URL)
+quota_sync_task = PeriodicTask("quota-sync", sync_usage_to_db, settings.QUOTA_SYNC_INTERVAL)
+# Flush en lote de incrementos de uso (camino sin Redis)
+usage_flush_task = PeriodicTask("usage-flush", rate_limiter.flush_pending_usage, settings.USAGE_FLUSH_INTERVAL)
+# last_used_at / total_requests de API keys
+key_usage_flush_task = PeriodicTask("key-usage-flush", api_key_manager.flush_pending_usage, settings.USAGE_FLUSH_INTERVAL)
+# Escritura en lote de validation_logs
+log_flush_task = PeriodicTask("log-flush", validation_logger.flush_pending_logs, settings.LOG_FLUSH_INTERVAL)
+# Cierre de conexiones SMTP ociosas del pool
+smtp_idle_task = PeriodicTask("smtp-idle-close", smtp_validator.pool.close_idle, 30)
+
+
+async def warm_mx_cache() -> None:
+    """
+    Resuelve el MX de los dominios mas comunes al arrancar: los primeros
+    requests ya los encuentran en cache (sin la consulta en frio)
+    """
+    domains = settings.MX_WARMUP_DOMAINS
+    if settings.USE_ORCHESTRATOR:
+        warm = orchestrator.warm_mx
+    else:
+        warm = email_validator.check_mx_records
+    results = await asyncio.gather(*(warm(d) for d in domains), return_exceptions=True)
+    failed = sum(isinstance(r, Exception) for r in results)
+    logger.info(f"MX cache warmed: {len(domains) - failed}/{len(domains)} domains")
+
+
+# Referencia al warmup en curso (create_task solo guarda una referencia debil)
+_mx_warmup: Optional[asyncio.Task] = None
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -67,22 +115,26 @@ app.include_router(
 )
 
 
+# Respuesta del root: solo depende de settings, se arma una vez al importar
+_ROOT_RESPONSE = {
+    "name": settings.APP_NAME,
+    "version": settings.APP_VERSION,
+    "docs": "/docs",
+    "health": f"{settings.API_V1_PREFIX}/health",
+    "endpoints": {
+        "validate_single": f"{settings.API_V1_PREFIX}/validate",
+        "validate_bulk": f"{settings.API_V1_PREFIX}/validate/bulk",
+        "stats": f"{settings.API_V1_PREFIX}/stats"
+    }
+}
+
+
 @app.get("/")
 async def root():
     """
     Root endpoint with API information
     """
-    return {
-        "name": settings.APP_NAME,
-        "version": settings.APP_VERSION,
-        "docs": "/docs",
-        "health": f"{settings.API_V1_PREFIX}/health",
-        "endpoints": {
-            "validate_single": f"{settings.API_V1_PREFIX}/validate",
-            "validate_bulk": f"{settings.API_V1_PREFIX}/validate/bulk",
-            "stats": f"{settings.API_V1_PREFIX}/stats"
-        }
-    }
+    return _ROOT_RESPONSE
 
 
 @app.on_event("startup")
@@ -90,18 +142,38 @@ async def startup_event():
     """
     Startup event handler
     """
-    print(f"🚀 {settings.APP_NAME} v{settings.APP_VERSION} starting...")
-    print(f"📍 API Documentation: http://localhost:8000/docs")
-    print(f"🔍 Health Check: http://localhost:8000{settings.API_V1_PREFIX}/health")
+    logger.info(f"{settings.APP_NAME} v{settings.APP_VERSION} starting...")
+    logger.info(f"API Documentation: http://localhost:8000/docs")
+    logger.info(f"Health Check: http://localhost:8000{settings.API_V1_PREFIX}/health")
     
-    # Inicializar base de datos
-    print("📦 Initializing database...")
+    # Inicializar base de datos (en un hilo: create_all hace I/O bloqueante)
+    logger.info("Initializing database...")
     try:
-        init_db()
-        print("✅ Database initialized successfully")
+        await asyncio.to_thread(init_db)
+        # Tablas ya existentes con el esquema anterior
+        await asyncio.to_thread(migrate_plaintext_api_keys)
+        logger.info("Database initialized successfully")
     except Exception as e:
-        print(f"⚠️  Database initialization failed: {e}")
-        print("   The API will work without database (no logging)")
+        logger.warning(f"Database initialization failed: {e}")
+        logger.warning("The API will work without database (no logging)")
+    
+    # Lista de dominios desechables en memoria (curada + tabla DisposableDomain)
+    try:
+        await refresh_disposable_domains()
+    except Exception as e:
+        logger.warning(f"Disposable domains not loaded from database: {e}")
+    
+    usage_flush_task.start()
+    key_usage_flush_task.start()
+    log_flush_task.start()
+    smtp_idle_task.start()
+    if settings.REDIS_URL:
+        quota_sync_task.start()
+    
+    # En segundo plano: el arranque no espera al DNS
+    global _mx_warmup
+    if settings.MX_WARMUP_DOMAINS:
+        _mx_warmup = asyncio.create_task(warm_mx_cache(), name="mx-warmup")
 
 
 
@@ -110,4 +182,12 @@ async def shutdown_event():
     """
     Shutdown event handler
     """
-    print(f"👋 {settings.APP_NAME} shutting down...")
+    logger.info(f"{settings.APP_NAME} shutting down...")
+    
+    await usage_flush_task.stop()
+    await key_usage_flush_task.stop()
+    await log_flush_task.stop()
+    await smtp_idle_task.stop()
+    await smtp_validator.close()
+    if settings.REDIS_URL:
+        await quota_sync_task.stop()
@@ -3,12 +3,16 @@ Authentication middleware for API key validation
 """
 
 from fastapi import Request, HTTPException, status, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from typing import Optional
-from app.core.database import SessionLocal
-from app.core.security import api_key_manager
-from app.models.database import User, ApiKey
+import hmac
+import time
+from app.core.config import settings
+from app.core.database import get_db
+from app.core.security import ApiKeySnapshot, UserSnapshot, api_key_manager, security_manager
+from app.services.cache import api_key_cache
 
 
 class ApiKeyAuth(HTTPBearer):
@@ -23,10 +27,13 @@ class ApiKeyAuth(HTTPBearer):
     def __init__(self, auto_error: bool = True):
         super(ApiKeyAuth, self).__init__(auto_error=auto_error)
     
-    async def __call__(self, request: Request) -> Optional[dict]:
+    async def __call__(self, request: Request, db: Session = Depends(get_db)) -> Optional[dict]:
         """
         Valida la API key del request
         
+        Usa la misma sesión por request que el endpoint (FastAPI resuelve
+        get_db una sola vez por request); en un hit de cache ni se usa.
+        
         Returns:
             dict con user y api_key si válido, None si inválido
         """
@@ -42,38 +49,89 @@ class ApiKeyAuth(HTTPBearer):
                 )
             return None
         
-        # Validar API key
-        db = SessionLocal()
-        try:
-            is_valid, api_key_obj, user = api_key_manager.validate_api_key(db, api_key)
-            
-            if not is_valid:
-                if self.auto_error:
-                    raise HTTPException(
-                        status_code=status.HTTP_401_UNAUTHORIZED,
-                        detail="Invalid or expired API key",
-                        headers={"WWW-Authenticate": "Bearer"},
-                    )
-                return None
-            
-            # Hacer refresh de los objetos antes de cerrar la sesión
-            # Esto carga todos los atributos en memoria
-            db.refresh(user)
-            db.refresh(api_key_obj)
-            
-            # Expunge los objetos de la sesión para que puedan usarse fuera
-            db.expunge(user)
-            db.expunge(api_key_obj)
-            
-            # Retornar información del usuario autenticado
-            return {
-                "user": user,
-                "api_key": api_key_obj,
-                "key_string": api_key
-            }
-            
-        finally:
-            db.close()
+        # Formato inválido: rechazar sin abrir sesión de DB
+        if not security_manager.validate_api_key_format(api_key):
+            return self._reject()
+        
+        resolved = await self._resolve_api_key(db, api_key)
+        
+        if not resolved:
+            return self._reject()
+        
+        api_key_obj, user = resolved
+        
+        # Retornar información del usuario autenticado
+        return {
+            "user": user,
+            "api_key": api_key_obj,
+            "key_string": api_key
+        }
+    
+    def _reject(self) -> None:
+        if self.auto_error:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid or expired API key",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        return None
+    
+    async def _resolve_api_key(self, db: Session, api_key: str) -> Optional[tuple]:
+        """
+        Resuelve la API key a (ApiKeySnapshot, UserSnapshot), pasando
+        primero por el cache
+        
+        En un hit no hay ninguna consulta; en un miss se hace la validación
+        completa en DB y el resultado queda cacheado. El uso de la key se
+        acumula en memoria y se escribe en lote (record_usage).
+        """
+        cache_key = security_manager.hash_api_key(api_key)
+        cached = api_key_cache.get(cache_key)
+        
+        if cached:
+            api_key_obj, user, expires_ts = cached
+            if expires_ts is None or expires_ts >= time.time():
+                self._record_usage(api_key_obj)
+                return api_key_obj, user
+            api_key_cache.pop(cache_key)
+        
+        # SQLAlchemy es síncrono: la consulta va al threadpool para no
+        # bloquear el event loop
+        entry = await run_in_threadpool(self._load_api_key, db, api_key, cache_key)
+        
+        if not entry:
+            return None
+        
+        api_key_obj, user, _ = entry
+        self._record_usage(api_key_obj)
+        api_key_cache.set(cache_key, entry)
+        
+        return api_key_obj, user
+    
+    @staticmethod
+    def _load_api_key(db: Session, api_key: str, key_hash: str) -> Optional[tuple]:
+        """
+        Valida la key contra la DB y devuelve la entrada de cache
+        (ApiKeySnapshot, UserSnapshot, expiración)
+        """
+        # Reusar el hash ya calculado para el cache: un solo HMAC por request
+        is_valid, api_key_obj, user = api_key_manager.validate_api_key(
+            db, api_key, key_hash=key_hash
+        )
+        
+        if not is_valid:
+            return None
+        
+        # El SELECT con joinedload ya trajo todas las columnas de ambos:
+        # se copian a snapshots y los objetos ORM quedan en la sesión
+        return api_key_manager.cache_entry(api_key_obj, user)
+    
+    @staticmethod
+    def _record_usage(api_key_obj) -> None:
+        now = api_key_manager.record_usage(api_key_obj.id)
+        # Mantener al día la copia cacheada (la usa /keys/current)
+        api_key_obj.last_used_at = now
+        api_key_obj.total_requests = (api_key_obj.total_requests or 0) + 1
     
     def _extract_api_key(self, request: Request) -> Optional[str]:
         """
@@ -84,20 +142,29 @@ class ApiKeyAuth(HTTPBearer):
         2. Header X-API-Key: <key>
         3. Query param ?api_key=<key> (menos seguro, pero útil para testing)
         """
+        # Una sola pasada por los headers crudos de ASGI (nombres ya en
+        # minúsculas); solo se decodifica lo que interesa
+        bearer = None
+        x_api_key = None
+        for name, value in request.scope["headers"]:
+            if name == b"authorization":
+                bearer = value
+            elif name == b"x-api-key":
+                x_api_key = value
+        
         # Opción 1: Authorization header
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            return auth_header.replace("Bearer ", "")
+        if bearer and bearer[:7] == b"Bearer ":
+            return bearer[7:].decode("latin-1")
         
         # Opción 2: X-API-Key header (más común en APIs)
-        x_api_key = request.headers.get("X-API-Key")
         if x_api_key:
-            return x_api_key
+            return x_api_key.decode("latin-1")
         
         # Opción 3: Query parameter (solo para testing/desarrollo)
-        api_key_param = request.query_params.get("api_key")
-        if api_key_param:
-            return api_key_param
+        if settings.ALLOW_QUERY_API_KEY:
+            api_key_param = request.query_params.get("api_key")
+            if api_key_param:
+                return api_key_param
         
         return None
 
@@ -118,13 +185,13 @@ require_api_key = ApiKeyAuth(auto_error=True)
 optional_api_key = OptionalApiKeyAuth()
 
 
-async def get_current_user(auth: dict = Depends(require_api_key)) -> User:
+async def get_current_user(auth: dict = Depends(require_api_key)) -> UserSnapshot:
     """
     Dependency para obtener el usuario actual autenticado
     
     Usage:
         @router.get("/me")
-        async def get_me(user: User = Depends(get_current_user)):
+        async def get_me(user: UserSnapshot = Depends(get_current_user)):
             return {"email": user.email}
     """
     if not auth:
@@ -136,13 +203,13 @@ async def get_current_user(auth: dict = Depends(require_api_key)) -> User:
     return auth["user"]
 
 
-async def get_current_api_key(auth: dict = Depends(require_api_key)) -> ApiKey:
+async def get_current_api_key(auth: dict = Depends(require_api_key)) -> ApiKeySnapshot:
     """
     Dependency para obtener la API key actual
     
     Usage:
         @router.get("/key-info")
-        async def key_info(api_key: ApiKey = Depends(get_current_api_key)):
+        async def key_info(api_key: ApiKeySnapshot = Depends(get_current_api_key)):
             return {"key_name": api_key.name}
     """
     if not auth:
@@ -152,3 +219,24 @@ async def get_current_api_key(auth: dict = Depends(require_api_key)) -> ApiKey:
         )
     
     return auth["api_key"]
+
+
+async def require_admin(request: Request) -> None:
+    """
+    Dependency para endpoints /admin/*
+    
+    Exige el header X-Admin-Token igual a settings.ADMIN_TOKEN; una API key
+    de cliente no alcanza. Sin ADMIN_TOKEN configurado, quedan deshabilitados.
+    """
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin endpoints are disabled"
+        )
+    
+    token = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode(), settings.ADMIN_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid admin token"
+        )
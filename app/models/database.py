@@ -2,7 +2,7 @@
 Database models for SQLAlchemy
 """
 
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text, ForeignKey
+from sqlalchemy import CHAR, Column, Integer, String, Float, Boolean, DateTime, Text, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.core.database import Base
@@ -14,6 +14,10 @@ class ValidationLog(Base):
     Registro de cada validación de email realizada
     """
     __tablename__ = "validation_logs"
+    __table_args__ = (
+        # Estadísticas por usuario en un rango de fechas
+        Index("ix_validation_logs_user_created", "user_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     
@@ -86,7 +90,10 @@ class ApiKey(Base):
     __tablename__ = "api_keys"
     
     id = Column(Integer, primary_key=True, index=True)
-    key = Column(String(100), unique=True, index=True, nullable=False)
+    # Solo se guarda el hash (HMAC-SHA256 hex) y un preview para mostrar;
+    # la key en texto plano se devuelve una única vez al crearla
+    key_hash = Column(CHAR(64), unique=True, index=True, nullable=False)
+    key_preview = Column(String(24), nullable=False)
     name = Column(String(100))  # Nombre descriptivo de la key
     
     # Association
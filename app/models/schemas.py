@@ -1,13 +1,25 @@
-from pydantic import BaseModel, EmailStr, Field
+import re
+from pydantic import BaseModel, Field, field_validator
 from typing import Optional
 from datetime import datetime
 
+# Forma mínima local@dominio.tld. El parseo completo (RFC/IDNA) se hace una
+# sola vez, en el validator; esto solo descarta basura obvia sin costo
+EMAIL_SHAPE_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
 
 class EmailValidationRequest(BaseModel):
-    email: EmailStr = Field(..., description="Email address to validate")
+    email: str = Field(..., description="Email address to validate")
     check_smtp: bool = Field(default=True, description="Perform SMTP mailbox verification")
     mode: str = Field(default="standard", description="quick | standard")
     
+    @field_validator("email")
+    @classmethod
+    def email_shape(cls, v: str) -> str:
+        if not EMAIL_SHAPE_RE.match(v):
+            raise ValueError("value is not a valid email address")
+        return v
+    
     class Config:
         json_schema_extra = {
             "example": {
@@ -80,7 +92,9 @@ class EmailValidationResponse(BaseModel):
 
 
 class BulkValidationRequest(BaseModel):
-    emails: list[EmailStr] = Field(..., max_length=100, description="List of emails to validate (max 100)")
+    # str simple: cada dirección la parsea una sola vez el validator (una
+    # inválida vuelve con syntax_valid=False en vez de fallar con 422)
+    emails: list[str] = Field(..., max_length=100, description="List of emails to validate (max 100)")
     check_smtp: bool = Field(default=False, description="Perform SMTP checks (slower)")
     
     class Config:
@@ -0,0 +1,58 @@
+"""
+Tareas periodicas en background (flush de contadores, sincronizaciones).
+
+Corren en el event loop; el trabajo sincrono (DB, Redis) se manda al
+threadpool para no frenar los requests, las funciones async se esperan
+directamente.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional, Union
+
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Union[None, Awaitable[None]]],
+        interval_seconds: float,
+    ):
+        self.name = name
+        self.func = func
+        self.interval = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=self.name)
+
+    async def stop(self) -> None:
+        """Cancela el loop y ejecuta una ultima vez para no perder lo pendiente."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.run_once()
+
+    async def run_once(self) -> None:
+        try:
+            if asyncio.iscoroutinefunction(self.func):
+                await self.func()
+            else:
+                await run_in_threadpool(self.func)
+        except Exception as e:
+            # Un fallo puntual (DB caida) no debe matar el loop
+            logger.warning(f"{self.name} failed: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
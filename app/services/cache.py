@@ -4,35 +4,95 @@ instancia en Railway); la interfaz permite cambiar a Redis despues sin
 tocar el orquestador.
 
 Que cachear: resultados de checks cuyo resultado depende del DOMINIO,
-no del email individual (mx, disposable). NO cachear syntax (trivial)
+no del email individual (mx). NO cachear syntax (trivial)
 ni smtp (depende del buzon individual).
+
+TTLCache es la base generica (TTL + tope de entradas con expulsion LRU);
+tambien la usa la autenticacion para no resolver la misma API key en DB
+en cada request. Cada entrada puede llevar su propio TTL (p.ej. mas corto
+para resultados negativos).
+
+DomainCache suma single-flight: si llegan N requests por el mismo dominio
+sin cachear, solo uno hace la consulta y el resto espera su resultado.
 """
 
+import asyncio
+import threading
 import time
-from typing import Any, Optional
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
 
 
-class DomainCache:
-    def __init__(self, ttl_seconds: int = 3600):
+class TTLCache:
+    def __init__(self, ttl_seconds: int = 3600, maxsize: Optional[int] = None):
         self.ttl = ttl_seconds
-        self._store: dict[str, tuple[float, Any]] = {}
+        self.maxsize = maxsize
+        self._store: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        # Se usa desde el event loop y desde el threadpool de FastAPI
+        self._lock = threading.Lock()
 
     def get(self, key: str) -> Optional[Any]:
-        entry = self._store.get(key)
-        if not entry:
-            return None
-        expires_at, value = entry
-        if time.time() > expires_at:
-            del self._store[key]
-            return None
-        return value
-
-    def set(self, key: str, value: Any) -> None:
-        self._store[key] = (time.time() + self.ttl, value)
+        with self._lock:
+            entry = self._store.get(key)
+            if not entry:
+                return None
+            expires_at, value = entry
+            if time.monotonic() > expires_at:
+                del self._store[key]
+                return None
+            self._store.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._store[key] = (expires_at, value)
+            self._store.move_to_end(key)
+            if self.maxsize and len(self._store) > self.maxsize:
+                # Expulsar la entrada menos usada recientemente
+                self._store.popitem(last=False)
+
+    def pop(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._store.pop(key, None)
+        return entry[1] if entry else None
 
     def clear(self) -> None:
-        self._store.clear()
+        with self._lock:
+            self._store.clear()
+
+
+class DomainCache(TTLCache):
+    def __init__(self, ttl_seconds: int = 3600, maxsize: Optional[int] = None):
+        super().__init__(ttl_seconds, maxsize)
+        # Consultas en curso por key (solo desde el event loop)
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Valor cacheado o, si no hay, el resultado de loader()
+
+        Los llamados concurrentes por la misma key comparten un unico
+        loader(). El loader decide que se cachea y con que TTL (set).
+        """
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        pending = self._inflight.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(loader())
+            self._inflight[key] = pending
+            pending.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        # shield: si un request se cancela, la consulta sigue para los demas
+        return await asyncio.shield(pending)
 
 
 # TTL de 1h: los MX de un dominio no cambian minuto a minuto
 domain_cache = DomainCache(ttl_seconds=3600)
+
+# Keys resueltas (ApiKey, User) por hash de la key. TTL corto para que
+# cambios hechos fuera de este proceso (revocacion, usuario desactivado)
+# se propaguen en menos de un minuto.
+api_key_cache = TTLCache(ttl_seconds=60, maxsize=10_000)
@@ -0,0 +1,113 @@
+"""
+Conjunto de dominios desechables en memoria.
+
+Union de la lista curada (BUILTIN_DISPOSABLE_DOMAINS, leida de
+app/data/disposable_domains.txt o de DISPOSABLE_DOMAINS_FILE, mas la
+blocklist de disposable-email-domains si DISPOSABLE_INCLUDE_PACKAGE_LIST)
+y la tabla DisposableDomain. La tabla se lee una vez al arrancar (main.startup) y al
+llamar a /admin/refresh-disposable; en el camino de cada email solo hay
+una busqueda en un frozenset, nunca una consulta a la DB.
+
+El conjunto se reemplaza entero (asignacion atomica): los lectores ven la
+version anterior o la nueva, nunca una a medio construir.
+"""
+
+import asyncio
+import logging
+from pathlib import Path
+
+from app.core.config import settings
+from app.core.database import session_scope
+from app.models.database import DisposableDomain
+
+logger = logging.getLogger(__name__)
+
+# Lista por defecto, empaquetada con la app
+DEFAULT_DISPOSABLE_FILE = Path(__file__).resolve().parent.parent / "data" / "disposable_domains.txt"
+
+
+def read_domain_file(path: Path) -> frozenset[str]:
+    """
+    Lee una lista de dominios (uno por linea, # para comentarios),
+    normalizada a minusculas
+    """
+    with open(path, encoding="utf-8") as f:
+        return frozenset(
+            line
+            for line in (raw.strip().lower() for raw in f)
+            if line and not line.startswith("#")
+        )
+
+
+def read_package_blocklist() -> frozenset[str]:
+    """
+    Blocklist del paquete disposable-email-domains (ya en requirements),
+    normalizada a minusculas
+    """
+    from disposable_email_domains import blocklist
+
+    return frozenset(d.strip().lower() for d in blocklist)
+
+
+# Lista curada (y opcionalmente la del paquete): se lee una sola vez, al importar
+BUILTIN_DISPOSABLE_DOMAINS: frozenset[str] = read_domain_file(
+    Path(settings.DISPOSABLE_DOMAINS_FILE or DEFAULT_DISPOSABLE_FILE)
+)
+if settings.DISPOSABLE_INCLUDE_PACKAGE_LIST:
+    BUILTIN_DISPOSABLE_DOMAINS |= read_package_blocklist()
+
+_domains: frozenset[str] = BUILTIN_DISPOSABLE_DOMAINS
+# Se incrementa en cada recarga (visible en logs y en la respuesta del refresh)
+_version = 0
+_refresh_lock = asyncio.Lock()
+
+
+def get_disposable_domains() -> frozenset[str]:
+    return _domains
+
+
+def is_disposable_domain(domain: str) -> bool:
+    """
+    domain ya normalizado (minusculas, sin espacios)
+
+    Tambien cuenta como desechable un subdominio de un dominio de la lista
+    (x.mailinator.com): se prueban los sufijos del propio dominio, una
+    busqueda por etiqueta, nunca un recorrido de la lista
+    """
+    domains = _domains
+    if domain in domains:
+        return True
+    labels = domain.split(".")
+    # El TLD solo nunca esta en la lista
+    for i in range(1, len(labels) - 1):
+        if ".".join(labels[i:]) in domains:
+            return True
+    return False
+
+
+def load_disposable_domains() -> tuple[int, int]:
+    """
+    Recarga el conjunto desde la tabla DisposableDomain (bloqueante)
+
+    Returns:
+        (cantidad de dominios en el conjunto, version)
+    """
+    global _domains, _version
+    with session_scope() as db:
+        rows = db.query(DisposableDomain.domain).all()
+
+    # Normalizar al cargar para que la busqueda sea un `in` directo
+    loaded = {d.strip().lower() for (d,) in rows if d}
+    _domains = BUILTIN_DISPOSABLE_DOMAINS | loaded
+    _version += 1
+    logger.info(f"Disposable domains loaded: {len(_domains)} (version {_version})")
+    return len(_domains), _version
+
+
+async def refresh_disposable_domains() -> tuple[int, int]:
+    """
+    Recarga desde el event loop: la consulta va a un hilo y el lock evita
+    recargas concurrentes
+    """
+    async with _refresh_lock:
+        return await asyncio.to_thread(load_disposable_domains)
@@ -2,17 +2,57 @@
 Service for logging email validations to database
 """
 
+import logging
+import threading
+from sqlalchemy import case, func, insert
 from sqlalchemy.orm import Session
+from app.core.database import session_scope
 from app.models.database import ValidationLog, UsageStats
 from datetime import datetime
 from typing import Optional
 
+logger = logging.getLogger(__name__)
+
+# Filas por INSERT multi-row al vaciar el buffer
+LOG_BATCH_SIZE = 100
+# Máximo de filas retenidas si la DB falla; se descartan las más viejas
+LOG_PENDING_MAX = 100_000
+
 
 class ValidationLogger:
     """
     Maneja el logging de validaciones en la base de datos
     """
     
+    # Logs pendientes de escribir (ver enqueue_validation / flush_pending_logs)
+    _pending: list[dict] = []
+    _pending_lock = threading.Lock()
+    
+    @staticmethod
+    def _log_row(
+        email: str,
+        validation_result: dict,
+        processing_time_ms: float,
+        user_id: Optional[int],
+        api_key_id: Optional[int]
+    ) -> dict:
+        return {
+            "email": email,
+            "domain": validation_result.get("domain"),
+            "is_valid": validation_result.get("is_valid", False),
+            "syntax_valid": validation_result.get("syntax_valid", False),
+            "has_mx_records": validation_result.get("has_mx_records", False),
+            "is_disposable": validation_result.get("is_disposable", False),
+            "smtp_check_performed": validation_result.get("smtp_check_performed", False),
+            "mailbox_exists": validation_result.get("mailbox_exists"),
+            "smtp_response": validation_result.get("smtp_response"),
+            "is_catch_all": validation_result.get("is_catch_all"),
+            "deliverability_score": validation_result.get("deliverability_score", 0.0),
+            "processing_time_ms": processing_time_ms,
+            "user_id": user_id,
+            "api_key_id": api_key_id,
+        }
+    
     @staticmethod
     def log_validation(
         db: Session,
@@ -36,22 +76,9 @@ class ValidationLogger:
         Returns:
             ValidationLog object
         """
-        log_entry = ValidationLog(
-            email=email,
-            domain=validation_result.get("domain"),
-            is_valid=validation_result.get("is_valid", False),
-            syntax_valid=validation_result.get("syntax_valid", False),
-            has_mx_records=validation_result.get("has_mx_records", False),
-            is_disposable=validation_result.get("is_disposable", False),
-            smtp_check_performed=validation_result.get("smtp_check_performed", False),
-            mailbox_exists=validation_result.get("mailbox_exists"),
-            smtp_response=validation_result.get("smtp_response"),
-            is_catch_all=validation_result.get("is_catch_all"),
-            deliverability_score=validation_result.get("deliverability_score", 0.0),
-            processing_time_ms=processing_time_ms,
-            user_id=user_id,
-            api_key_id=api_key_id
-        )
+        log_entry = ValidationLog(**ValidationLogger._log_row(
+            email, validation_result, processing_time_ms, user_id, api_key_id
+        ))
         
         db.add(log_entry)
         db.commit()
@@ -59,6 +86,87 @@ class ValidationLogger:
         
         return log_entry
     
+    @staticmethod
+    def enqueue_validation(
+        email: str,
+        validation_result: dict,
+        processing_time_ms: float,
+        user_id: Optional[int] = None,
+        api_key_id: Optional[int] = None
+    ) -> None:
+        """
+        Encola un registro de validación sin tocar la DB
+        
+        Lo escribe flush_pending_logs en segundo plano; el request no
+        espera el INSERT.
+        """
+        row = ValidationLogger._log_row(
+            email, validation_result, processing_time_ms, user_id, api_key_id
+        )
+        # Hora de la validación, no la del flush
+        row["created_at"] = datetime.utcnow()
+        
+        with ValidationLogger._pending_lock:
+            ValidationLogger._pending.append(row)
+    
+    @staticmethod
+    def enqueue_validations(
+        results: list[dict],
+        user_id: Optional[int] = None,
+        api_key_id: Optional[int] = None
+    ) -> None:
+        """
+        Encola los registros de un lote (validación bulk) de una sola vez
+        
+        Un solo lock para todo el lote; el flush los inserta con los
+        INSERT multi-row de siempre. Sin tiempo individual (no se mide en bulk).
+        
+        Args:
+            results: Resultados del validator (cada uno trae su "email")
+        """
+        now = datetime.utcnow()
+        rows = []
+        for result in results:
+            row = ValidationLogger._log_row(
+                result["email"], result, None, user_id, api_key_id
+            )
+            row["created_at"] = now
+            rows.append(row)
+        
+        with ValidationLogger._pending_lock:
+            ValidationLogger._pending.extend(rows)
+    
+    @staticmethod
+    def flush_pending_logs() -> None:
+        """
+        Escribe los registros encolados con INSERTs multi-row de hasta
+        LOG_BATCH_SIZE filas
+        
+        Todo va en una transacción: si falla, las filas vuelven al buffer
+        (delante de las encoladas mientras tanto) para el próximo intento.
+        """
+        with ValidationLogger._pending_lock:
+            if not ValidationLogger._pending:
+                return
+            rows = ValidationLogger._pending
+            ValidationLogger._pending = []
+        
+        try:
+            with session_scope() as db:
+                for i in range(0, len(rows), LOG_BATCH_SIZE):
+                    db.execute(insert(ValidationLog), rows[i:i + LOG_BATCH_SIZE])
+        except Exception:
+            with ValidationLogger._pending_lock:
+                pending = rows + ValidationLogger._pending
+                # Con la DB caída el buffer no crece sin límite
+                dropped = len(pending) - LOG_PENDING_MAX
+                if dropped > 0:
+                    pending = pending[dropped:]
+                ValidationLogger._pending = pending
+            if dropped > 0:
+                logger.error(f"Validation log buffer full: dropped {dropped} oldest rows")
+            raise
+    
     @staticmethod
     def get_user_validation_count(
         db: Session,
@@ -102,16 +210,25 @@ class ValidationLogger:
         Returns:
             Diccionario con estadísticas
         """
-        query = db.query(ValidationLog).filter(ValidationLog.user_id == user_id)
+        # Un solo SELECT de agregados: la DB recorre el índice
+        # (user_id, created_at) y devuelve una fila, sin traer los logs
+        query = db.query(
+            func.count(ValidationLog.id),
+            func.sum(case((ValidationLog.is_valid == True, 1), else_=0)),
+            func.sum(case((ValidationLog.is_disposable == True, 1), else_=0)),
+            func.sum(case((ValidationLog.smtp_check_performed == True, 1), else_=0)),
+            func.sum(ValidationLog.deliverability_score),
+            func.sum(ValidationLog.processing_time_ms),
+        ).filter(ValidationLog.user_id == user_id)
         
         if start_date:
             query = query.filter(ValidationLog.created_at >= start_date)
         if end_date:
             query = query.filter(ValidationLog.created_at <= end_date)
         
-        logs = query.all()
+        total, valid_count, disposable_count, smtp_checks, score_sum, time_sum = query.one()
         
-        if not logs:
+        if not total:
             return {
                 "total_validations": 0,
                 "valid_count": 0,
@@ -122,13 +239,9 @@ class ValidationLogger:
                 "avg_processing_time_ms": 0.0
             }
         
-        total = len(logs)
-        valid_count = sum(1 for log in logs if log.is_valid)
-        disposable_count = sum(1 for log in logs if log.is_disposable)
-        smtp_checks = sum(1 for log in logs if log.smtp_check_performed)
-        
-        avg_score = sum(log.deliverability_score for log in logs) / total
-        avg_time = sum(log.processing_time_ms for log in logs if log.processing_time_ms) / total
+        # Promedios sobre el total de filas (los tiempos NULL cuentan como 0)
+        avg_score = (score_sum or 0.0) / total
+        avg_time = (time_sum or 0.0) / total
         
         return {
             "total_validations": total,
@@ -7,20 +7,28 @@ contrato actual de EmailValidationResponse (RapidAPI intacto) mas los
 campos nuevos opcionales (verdict, checks).
 """
 
+import asyncio
 import time
 from typing import Any, Optional
 
 from app.checkers.base import CheckContext, Checker
 from app.checkers.registry import build_checkers
+from app.core.config import settings
 from app.core.policy import Policy, policy
 from app.core.results import CheckResult, CheckStatus, EmailAssessment
 from app.scoring.scorer import Scorer, scorer
 from app.services.cache import DomainCache, domain_cache
 
-# Checks cuyo resultado es por-dominio y por tanto cacheables
-CACHEABLE = {"mx", "disposable"}
+# Checks cuyo resultado es por-dominio y por tanto cacheables. disposable
+# no entra: ya es una busqueda en un frozenset y, sin cache propio, una
+# recarga de la lista se ve de inmediato
+CACHEABLE = {"mx"}
 
-# Checks rapidos que corren siempre (en este orden)
+# TTL (segundos) de resultados FAIL cacheados (NXDOMAIN, sin MX)
+NEGATIVE_TTL = 300
+
+# Checks rapidos que corren siempre, concurrentes entre si (ninguno depende
+# de otro); los resultados quedan en este orden
 FAST_CHECKS = ("mx", "disposable", "role_account")
 
 
@@ -38,7 +46,7 @@ class Orchestrator:
         self.policy = pol or policy
 
     async def assess(self, email: str, mode: str = "standard") -> EmailAssessment:
-        start = time.time()
+        start = time.perf_counter()
         assessment = EmailAssessment(email=email)
 
         # ---- 1. Sintaxis (short-circuit si falla) ----
@@ -58,7 +66,7 @@ class Orchestrator:
             assessment.email = normalized
             email = normalized
 
-        domain = email.split("@")[1].lower()
+        domain = email.rpartition("@")[2].lower()
         assessment.domain = domain
         ctx = CheckContext(email=email, domain=domain)
 
@@ -86,8 +94,12 @@ class Orchestrator:
             return self._finish(assessment, start)
 
         # ---- 3. Checks rapidos (con cache por dominio) ----
-        for name in FAST_CHECKS:
-            result = await self._run_cached(name, ctx)
+        # Un checker que en el futuro haga I/O (p.ej. disposable contra
+        # Redis) no se suma a la latencia del DNS
+        fast = await asyncio.gather(
+            *(self._run_cached(name, ctx) for name in FAST_CHECKS)
+        )
+        for name, result in zip(FAST_CHECKS, fast):
             assessment.checks.append(result)
             # Propagar MX al contexto compartido para SMTP
             if name == "mx" and result.status == CheckStatus.PASS:
@@ -95,7 +107,23 @@ class Orchestrator:
 
         # ---- 4. SMTP segun modo y politica ----
         smtp_cfg = self.policy.mode_config(mode).get("smtp", True)
-        if smtp_cfg is True:
+        disposable = assessment.get("disposable")
+        if (
+            settings.SKIP_SMTP_ON_DISPOSABLE
+            and disposable is not None
+            and disposable.status == CheckStatus.FAIL
+        ):
+            # El veredicto ya es REJECT (REJECT_ON_FAIL): no gastar una
+            # conexion SMTP en un dominio desechable. SKIPPED sale del
+            # denominador del score, por eso es opcional
+            assessment.checks.append(
+                CheckResult(
+                    "smtp", CheckStatus.SKIPPED,
+                    self.checkers["smtp"].weight,
+                    note="Dominio desechable: SMTP omitido",
+                )
+            )
+        elif smtp_cfg is True:
             if self.policy.smtp_blocked(domain):
                 assessment.checks.append(
                     CheckResult(
@@ -134,22 +162,35 @@ class Orchestrator:
         )
         return self._finish(assessment, start)
 
+    async def warm_mx(self, domain: str) -> None:
+        """Deja el MX de domain en cache (arranque), sin evaluar un email."""
+        await self._run_cached("mx", CheckContext(email=f"postmaster@{domain}", domain=domain))
+
     async def _run_cached(self, name: str, ctx: CheckContext) -> CheckResult:
         if name in CACHEABLE:
             key = f"{name}:{ctx.domain}"
-            cached = self.cache.get(key)
-            if cached is not None:
-                return cached
-            result = await self.checkers[name].run(ctx)
-            # Solo cachear resultados concluyentes
-            if result.status in (CheckStatus.PASS, CheckStatus.FAIL):
-                self.cache.set(key, result)
-            return result
+
+            async def load() -> CheckResult:
+                result = await self.checkers[name].run(ctx)
+                # Solo cachear resultados concluyentes; los negativos con
+                # TTL corto y los positivos no mas que el TTL del registro
+                if result.status == CheckStatus.PASS:
+                    ttl = result.detail.get("ttl")
+                    if ttl is not None:
+                        # TTL 0 = no reusar la respuesta
+                        ttl = min(ttl, self.cache.ttl)
+                    self.cache.set(key, result, ttl=ttl)
+                elif result.status == CheckStatus.FAIL:
+                    self.cache.set(key, result, ttl=NEGATIVE_TTL)
+                return result
+
+            # Requests concurrentes por el mismo dominio comparten la consulta
+            return await self.cache.get_or_load(key, load)
         return await self.checkers[name].run(ctx)
 
     @staticmethod
     def _finish(a: EmailAssessment, start: float) -> EmailAssessment:
-        a.processing_time_ms = round((time.time() - start) * 1000, 2)
+        a.processing_time_ms = round((time.perf_counter() - start) * 1000, 2)
         return a
 
 
@@ -2,11 +2,36 @@
 Rate limiting service for quota management
 """
 
+import threading
+from collections import defaultdict
 from datetime import datetime, timedelta
+from sqlalchemy import bindparam, case, func, or_, update
 from sqlalchemy.orm import Session
 from app.models.database import User, ValidationLog
 from app.core.config import settings
-from typing import Tuple
+from app.core.database import session_scope
+from app.core.redis import get_redis
+from app.services.cache import TTLCache
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple
+
+# Contadores en Redis: rl:{user_id}:{YYYYMM}. Viven un poco mas que el mes
+# para que el ultimo sync a DB del periodo alcance a leerlos.
+USAGE_KEY_TTL = 35 * 86400
+# Plan cacheado en el hash user:{id}
+PLAN_CACHE_TTL = 3600
+
+# Sin Redis, los incrementos se acumulan en memoria y se escriben en lote
+# (un UPDATE por usuario) en vez de un UPDATE por request. Solo los escribe
+# la tarea periodica usage-flush: un error de DB nunca llega al request
+_pending_usage: defaultdict[int, int] = defaultdict(int)
+_pending_lock = threading.Lock()
+
+# Sin Redis: (plan, usados en DB, próximo reset) por usuario, por unos
+# segundos. Absorbe los checks repetidos de un mismo usuario; lo pendiente
+# en memoria se suma aparte, y cada escritura en DB invalida la entrada
+QUOTA_CACHE_TTL = 5
+_quota_cache = TTLCache(ttl_seconds=QUOTA_CACHE_TTL, maxsize=10_000)
 
 
 class RateLimiter:
@@ -14,12 +39,82 @@ class RateLimiter:
     Gestiona rate limiting y cuotas por plan
     """
     
-    # Límites por plan (validaciones por mes)
-    PLAN_LIMITS = {
+    # Límites por plan (validaciones por mes). Solo lectura: se fija al importar
+    PLAN_LIMITS: Mapping[str, int] = MappingProxyType({
         "free": settings.RATE_LIMIT_FREE,      # 100
         "basic": settings.RATE_LIMIT_BASIC,    # 5,000
         "pro": settings.RATE_LIMIT_PRO,        # 50,000
-    }
+    })
+    
+    @staticmethod
+    def _next_reset(now: datetime) -> datetime:
+        """Primer día del mes siguiente"""
+        if now.month == 12:
+            return datetime(now.year + 1, 1, 1)
+        return datetime(now.year, now.month + 1, 1)
+    
+    @staticmethod
+    def _usage_key(user_id: int, now: Optional[datetime] = None) -> str:
+        return f"rl:{user_id}:{(now or datetime.utcnow()):%Y%m}"
+    
+    @staticmethod
+    def _build_quota_info(user_id: int, plan: str, used: int, reset_at: Optional[datetime]) -> dict:
+        plan_limit = RateLimiter.PLAN_LIMITS.get(plan, 100)
+        remaining = max(0, plan_limit - used)
+        percentage_used = (used / plan_limit * 100) if plan_limit > 0 else 0
+        
+        return {
+            "user_id": user_id,
+            "plan": plan,
+            "quota_limit": plan_limit,
+            "quota_used": used,
+            "quota_remaining": remaining,
+            "percentage_used": round(percentage_used, 2),
+            "reset_at": reset_at.isoformat() if reset_at else None
+        }
+    
+    @staticmethod
+    def _redis_usage(r, db: Session, user_id: int) -> Optional[Tuple[str, int]]:
+        """
+        Lee (plan, usados) desde Redis con un solo round-trip.
+        
+        Si falta el plan o el contador del periodo, se completa desde DB y se
+        deja sembrado en Redis. Devuelve None si el usuario no existe.
+        """
+        now = datetime.utcnow()
+        key = RateLimiter._usage_key(user_id, now)
+        user_key = f"user:{user_id}"
+        
+        pipe = r.pipeline()
+        pipe.get(key)
+        pipe.hget(user_key, "plan")
+        used, plan = pipe.execute()
+        
+        if used is not None and plan is not None:
+            return plan, int(used)
+        
+        user = db.query(User.plan, User.validations_used, User.quota_reset_at).filter(
+            User.id == user_id
+        ).first()
+        if not user:
+            return None
+        
+        if plan is None:
+            plan = user.plan
+            pipe = r.pipeline()
+            pipe.hset(user_key, "plan", plan)
+            pipe.expire(user_key, PLAN_CACHE_TTL)
+            pipe.execute()
+        
+        if used is None:
+            # Primer uso del periodo en Redis: partir de lo que ya tenga DB
+            # si DB sigue en el periodo actual, si no desde cero
+            seed = user.validations_used if user.quota_reset_at and user.quota_reset_at > now else 0
+            # SET NX: si otro worker sembro primero, gana el suyo
+            r.set(key, seed, ex=USAGE_KEY_TTL, nx=True)
+            used = r.get(key)
+        
+        return plan, int(used)
     
     @staticmethod
     def get_user_quota_info(db: Session, user_id: int) -> dict:
@@ -33,46 +128,62 @@ class RateLimiter:
         Returns:
             dict con información de cuota
         """
-        user = db.query(User).filter(User.id == user_id).first()
-        
-        if not user:
-            return {
-                "error": "User not found"
-            }
+        r = get_redis()
+        if r is not None:
+            usage = RateLimiter._redis_usage(r, db, user_id)
+            if usage is None:
+                return {
+                    "error": "User not found"
+                }
+            plan, used = usage
+            next_reset = RateLimiter._next_reset(datetime.utcnow())
+            return RateLimiter._build_quota_info(user_id, plan, used, next_reset)
         
         # Calcular inicio del periodo actual
         now = datetime.utcnow()
         
-        # Si es el primer día del mes o no hay reset date, establecer inicio de mes
-        if not user.quota_reset_at or user.quota_reset_at <= now:
-            # Calcular próximo reset (primer día del siguiente mes)
-            if now.month == 12:
-                next_reset = datetime(now.year + 1, 1, 1)
-            else:
-                next_reset = datetime(now.year, now.month + 1, 1)
-            
-            # Reset de contador si es nuevo periodo
-            if not user.quota_reset_at or user.quota_reset_at <= now:
-                user.validations_used = 0
-                user.quota_reset_at = next_reset
-                db.commit()
+        cached = _quota_cache.get(user_id)
+        if cached is not None and cached[2] > now:
+            plan, used, reset_at = cached
+            with _pending_lock:
+                pending = _pending_usage.get(user_id, 0)
+            return RateLimiter._build_quota_info(user_id, plan, used + pending, reset_at)
         
-        # Obtener límite del plan
-        plan_limit = RateLimiter.PLAN_LIMITS.get(user.plan, 100)
+        # Solo las columnas necesarias; no se hidrata el objeto User
+        user = db.query(
+            User.plan, User.validations_used, User.quota_reset_at
+        ).filter(User.id == user_id).first()
         
-        # Calcular uso
-        remaining = max(0, plan_limit - user.validations_used)
-        percentage_used = (user.validations_used / plan_limit * 100) if plan_limit > 0 else 0
+        if not user:
+            return {
+                "error": "User not found"
+            }
         
-        return {
-            "user_id": user.id,
-            "plan": user.plan,
-            "quota_limit": plan_limit,
-            "quota_used": user.validations_used,
-            "quota_remaining": remaining,
-            "percentage_used": round(percentage_used, 2),
-            "reset_at": user.quota_reset_at.isoformat() if user.quota_reset_at else None
-        }
+        used, reset_at = user.validations_used, user.quota_reset_at
+        
+        # Reset de contador si es nuevo periodo (o no hay reset date)
+        if not reset_at or reset_at <= now:
+            used, reset_at = 0, RateLimiter._next_reset(now)
+            # La condición va en el WHERE: si dos requests detectan el cambio
+            # de periodo a la vez, solo el primero resetea y el segundo no
+            # borra los incrementos que ya se hayan escrito entre medio
+            db.execute(
+                update(User)
+                .where(
+                    User.id == user_id,
+                    or_(User.quota_reset_at.is_(None), User.quota_reset_at <= now)
+                )
+                .values(validations_used=used, quota_reset_at=reset_at)
+            )
+            db.commit()
+        
+        _quota_cache.set(user_id, (user.plan, used, reset_at))
+        
+        # Sumar lo que aun no se escribio en DB
+        with _pending_lock:
+            pending = _pending_usage.get(user_id, 0)
+        
+        return RateLimiter._build_quota_info(user_id, user.plan, used + pending, reset_at)
     
     @staticmethod
     def check_rate_limit(db: Session, user_id: int) -> Tuple[bool, dict]:
@@ -109,16 +220,56 @@ class RateLimiter:
         Returns:
             True si se incrementó exitosamente
         """
-        user = db.query(User).filter(User.id == user_id).first()
-        
-        if not user:
-            return False
-        
-        user.validations_used += count
-        db.commit()
+        r = get_redis()
+        if r is not None:
+            # INCR atómico; validations_used en DB se actualiza en
+            # sync_usage_to_db, no en cada request
+            pipe = r.pipeline()
+            pipe.incrby(RateLimiter._usage_key(user_id), count)
+            pipe.expire(RateLimiter._usage_key(user_id), USAGE_KEY_TTL)
+            pipe.execute()
+            return True
+        
+        with _pending_lock:
+            _pending_usage[user_id] += count
         
         return True
     
+    @staticmethod
+    def flush_pending_usage() -> None:
+        """
+        Escribe en DB los incrementos acumulados por increment_usage
+        
+        Un solo executemany: UPDATE users SET validations_used =
+        validations_used + :n WHERE id = :uid, una fila por usuario.
+        """
+        with _pending_lock:
+            if not _pending_usage:
+                return
+            pending = dict(_pending_usage)
+            _pending_usage.clear()
+        
+        stmt = (
+            update(User.__table__)
+            .where(User.__table__.c.id == bindparam("uid"))
+            .values(validations_used=User.__table__.c.validations_used + bindparam("n"))
+        )
+        rows = [{"uid": user_id, "n": n} for user_id, n in pending.items()]
+        
+        try:
+            with session_scope() as db:
+                db.execute(stmt, rows)
+        except Exception:
+            # Devolver al buffer para el próximo intento
+            with _pending_lock:
+                for user_id, n in pending.items():
+                    _pending_usage[user_id] += n
+            raise
+        
+        # Lo pendiente ya está en DB: el próximo check relee esos usuarios
+        for user_id in pending:
+            _quota_cache.pop(user_id)
+    
     @staticmethod
     def reset_user_quota(db: Session, user_id: int) -> bool:
         """
@@ -133,22 +284,27 @@ class RateLimiter:
         Returns:
             True si se reseteó exitosamente
         """
-        user = db.query(User).filter(User.id == user_id).first()
+        # Un solo UPDATE (con el próximo reset); rowcount dice si existe
+        result = db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(
+                validations_used=0,
+                quota_reset_at=RateLimiter._next_reset(datetime.utcnow())
+            )
+        )
+        db.commit()
         
-        if not user:
+        if result.rowcount != 1:
             return False
         
-        user.validations_used = 0
-        
-        # Establecer próximo reset
-        now = datetime.utcnow()
-        if now.month == 12:
-            next_reset = datetime(now.year + 1, 1, 1)
-        else:
-            next_reset = datetime(now.year, now.month + 1, 1)
+        with _pending_lock:
+            _pending_usage.pop(user_id, None)
+        _quota_cache.pop(user_id)
         
-        user.quota_reset_at = next_reset
-        db.commit()
+        r = get_redis()
+        if r is not None:
+            r.set(RateLimiter._usage_key(user_id), 0, ex=USAGE_KEY_TTL)
         
         return True
     
@@ -168,21 +324,33 @@ class RateLimiter:
         if new_plan not in RateLimiter.PLAN_LIMITS:
             return False
         
-        user = db.query(User).filter(User.id == user_id).first()
+        quota = RateLimiter.PLAN_LIMITS[new_plan]
         
-        if not user:
-            return False
+        # Si es upgrade, no resetear contador (mantener validaciones del mes)
+        # Si es downgrade y excede el nuevo límite, ajustar (en el mismo UPDATE)
+        result = db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(
+                plan=new_plan,
+                monthly_quota=quota,
+                validations_used=case(
+                    (User.validations_used > quota, quota),
+                    else_=User.validations_used
+                )
+            )
+        )
+        db.commit()
         
-        old_plan = user.plan
-        user.plan = new_plan
-        user.monthly_quota = RateLimiter.PLAN_LIMITS[new_plan]
+        if result.rowcount != 1:
+            return False
         
-        # Si es upgrade, no resetear contador (mantener validaciones del mes)
-        # Si es downgrade y excede el nuevo límite, ajustar
-        if user.validations_used > user.monthly_quota:
-            user.validations_used = user.monthly_quota
+        _quota_cache.pop(user_id)
         
-        db.commit()
+        r = get_redis()
+        if r is not None:
+            # El próximo check vuelve a leer el plan desde DB
+            r.delete(f"user:{user_id}")
         
         return True
     
@@ -201,12 +369,18 @@ class RateLimiter:
         """
         start_date = datetime.utcnow() - timedelta(days=days)
         
-        logs = db.query(ValidationLog).filter(
+        # Agregados en SQL: una fila en vez de todos los logs del periodo
+        total, valid, score_sum, smtp_checks = db.query(
+            func.count(ValidationLog.id),
+            func.sum(case((ValidationLog.is_valid == True, 1), else_=0)),
+            func.sum(ValidationLog.deliverability_score),
+            func.sum(case((ValidationLog.smtp_check_performed == True, 1), else_=0)),
+        ).filter(
             ValidationLog.user_id == user_id,
             ValidationLog.created_at >= start_date
-        ).all()
+        ).one()
         
-        if not logs:
+        if not total:
             return {
                 "period_days": days,
                 "total_validations": 0,
@@ -215,9 +389,7 @@ class RateLimiter:
                 "avg_score": 0.0
             }
         
-        total = len(logs)
-        valid = sum(1 for log in logs if log.is_valid)
-        avg_score = sum(log.deliverability_score for log in logs) / total
+        avg_score = (score_sum or 0.0) / total
         
         return {
             "period_days": days,
@@ -225,9 +397,39 @@ class RateLimiter:
             "valid_emails": valid,
             "invalid_emails": total - valid,
             "avg_score": round(avg_score, 2),
-            "smtp_checks": sum(1 for log in logs if log.smtp_check_performed)
+            "smtp_checks": smtp_checks
         }
 
 
+def sync_usage_to_db() -> None:
+    """
+    Copia los contadores del periodo actual de Redis a users.validations_used.
+    
+    Pensado para correr periódicamente en background; sin Redis no hace nada.
+    """
+    r = get_redis()
+    if r is None:
+        return
+    
+    now = datetime.utcnow()
+    next_reset = RateLimiter._next_reset(now)
+    keys = list(r.scan_iter(match=f"rl:*:{now:%Y%m}", count=1000))
+    if not keys:
+        return
+    
+    values = r.mget(keys)
+    rows = [
+        {"id": int(key.split(":")[1]), "validations_used": int(value), "quota_reset_at": next_reset}
+        for key, value in zip(keys, values)
+        if value is not None
+    ]
+    if not rows:
+        return
+    
+    # UPDATE por primary key en lote (executemany)
+    with session_scope() as db:
+        db.execute(update(User), rows)
+
+
 # Singleton instance
 rate_limiter = RateLimiter()
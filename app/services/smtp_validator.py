@@ -3,23 +3,147 @@ SMTP Validator Service
 
 Verifica la existencia de buzones de correo usando el protocolo SMTP.
 Implementa verificación RCPT TO sin enviar emails reales.
+
+Las conexiones se reutilizan por host MX (SMTPConnectionPool): tras cada
+verificación se hace RSET y la conexión queda lista para la siguiente, sin
+repetir TCP + banner + HELO.
 """
 
-import smtplib
 import socket
 import asyncio
+import time
 from typing import Tuple, Optional
+
+import aiosmtplib
+
 from app.core.config import settings
+from app.services.cache import TTLCache
+
+# Conexiones ociosas por host MX que se conservan
+POOL_MAX_IDLE_PER_HOST = 4
+# Segundos que una conexión puede quedar ociosa antes de cerrarla
+POOL_IDLE_SECONDS = 60
+# RCPTs por conexión antes de reemplazarla (los servidores limitan por sesión)
+POOL_MAX_RCPTS = 10_000
+# RCPTs por transacción (MAIL FROM ... RSET); RFC 5321 exige aceptar al menos 100
+RCPT_PER_TRANSACTION = 50
+
+NON_ASCII_MESSAGE = (
+    "SMTP verification inconclusive: mail server does not support non-ASCII addresses (SMTPUTF8)"
+)
+
+
+class SMTPConnectionPool:
+    """
+    Conexiones SMTP abiertas (ya con EHLO/HELO) por host MX
+    
+    Se usa solo desde el event loop: acquire() entrega la conexión en
+    exclusiva y release() la devuelve tras un RSET exitoso.
+    """
+    
+    def __init__(
+        self,
+        max_idle_per_host: int = POOL_MAX_IDLE_PER_HOST,
+        idle_seconds: float = POOL_IDLE_SECONDS,
+        max_rcpts: int = POOL_MAX_RCPTS
+    ):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_seconds = idle_seconds
+        self.max_rcpts = max_rcpts
+        # host -> [(smtp, último uso, RCPTs enviados)]
+        self._idle: dict[str, list[tuple[aiosmtplib.SMTP, float, int]]] = {}
+    
+    async def acquire(self, host: str) -> Optional[Tuple[aiosmtplib.SMTP, int]]:
+        """
+        Conexión ociosa para host, o None si no hay ninguna reutilizable
+        
+        Returns:
+            (smtp, RCPTs ya enviados por esa conexión)
+        """
+        stale = []
+        found = None
+        now = time.monotonic()
+        conns = self._idle.get(host)
+        while conns:
+            smtp, last_used, rcpts = conns.pop()
+            if now - last_used <= self.idle_seconds and smtp.is_connected:
+                found = (smtp, rcpts)
+                break
+            stale.append(smtp)
+        
+        for smtp in stale:
+            await self.close_connection(smtp)
+        return found
+    
+    async def release(self, host: str, smtp: aiosmtplib.SMTP, rcpts: int) -> None:
+        """
+        Devuelve una conexión (ya reseteada con RSET) para reutilizarla
+        """
+        if rcpts < self.max_rcpts:
+            conns = self._idle.setdefault(host, [])
+            if len(conns) < self.max_idle_per_host:
+                conns.append((smtp, time.monotonic(), rcpts))
+                return
+        await self.close_connection(smtp)
+    
+    async def close_idle(self) -> None:
+        """
+        Cierra las conexiones ociosas por más de idle_seconds
+        """
+        stale = []
+        now = time.monotonic()
+        for host in list(self._idle):
+            conns = self._idle[host]
+            keep = [c for c in conns if now - c[1] <= self.idle_seconds]
+            stale.extend(c[0] for c in conns if now - c[1] > self.idle_seconds)
+            if keep:
+                self._idle[host] = keep
+            else:
+                del self._idle[host]
+        
+        for smtp in stale:
+            await self.close_connection(smtp)
+    
+    async def close_all(self) -> None:
+        conns = [c[0] for host_conns in self._idle.values() for c in host_conns]
+        self._idle.clear()
+        
+        for smtp in conns:
+            await self.close_connection(smtp)
+    
+    @staticmethod
+    async def close_connection(smtp: aiosmtplib.SMTP) -> None:
+        try:
+            await smtp.quit()
+        except Exception:
+            smtp.close()
 
 
 class SMTPValidator:
     """
     Validador SMTP para verificar existencia de buzones de correo
+    
+    Usa aiosmtplib: los sockets los atiende el event loop, sin hilos de por
+    medio ni un executor que limite cuántas verificaciones hay en curso.
     """
     
     def __init__(self):
         self.timeout = settings.SMTP_TIMEOUT
         self.from_email = settings.SMTP_FROM_EMAIL
+        self.pool = SMTPConnectionPool()
+        # Dominio -> es catch-all (resultado de la sonda, válido un día)
+        self.catch_all_cache = TTLCache(ttl_seconds=86400, maxsize=5_000)
+        # Sesiones SMTP en curso a la vez; el resto espera aquí
+        self.semaphore = asyncio.Semaphore(settings.SMTP_MAX_CONCURRENCY)
+        # Hostname para EHLO/HELO: se resuelve una sola vez (getfqdn puede
+        # tardar segundos con un DNS inverso mal configurado)
+        self._local_hostname = settings.SMTP_HELO_HOSTNAME or self._get_local_hostname()
+    
+    async def close(self) -> None:
+        """
+        Cierra las conexiones del pool (shutdown de la app)
+        """
+        await self.pool.close_all()
     
     async def verify_mailbox(
         self, 
@@ -37,97 +161,242 @@ class SMTPValidator:
             Tuple of (exists: bool, response: str, is_catch_all: bool)
         """
         try:
-            # Ejecutar verificación SMTP en executor para evitar bloquear
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None, 
-                self._smtp_verify_sync, 
-                email, 
-                mx_host
-            )
-            return result
+            async with self.semaphore:
+                return (await self._verify_mailboxes(mx_host, [email]))[0]
             
         except Exception as e:
             return False, f"Error: {str(e)}", False
     
-    def _smtp_verify_sync(
-        self, 
-        email: str, 
-        mx_host: str
-    ) -> Tuple[Optional[bool], str, bool]:
+    async def verify_mailboxes(
+        self,
+        mx_host: str,
+        emails: list
+    ) -> list:
+        """
+        Verifica varios mailboxes que comparten servidor MX en una sola sesión
+        
+        Un solo connect + HELO y un MAIL FROM por transacción para todos
+        los RCPT TO.
+        
+        Args:
+            mx_host: MX server hostname
+            emails: Emails a verificar (todos entregados por mx_host)
+            
+        Returns:
+            Lista de (exists, response, is_catch_all), en el orden de emails
+        """
+        try:
+            async with self.semaphore:
+                return await self._verify_mailboxes(mx_host, emails)
+        except Exception as e:
+            # Sin respuesta del servidor no hay nada concluyente
+            return [(None, self._inconclusive_message(e), False)] * len(emails)
+    
+    async def _verify_mailboxes(self, mx_host: str, emails: list) -> list:
         """
-        Verificación SMTP síncrona (se ejecuta en thread pool)
+        Verificación SMTP
         
         Proceso:
-        1. Conectar al servidor MX
-        2. HELO/EHLO
-        3. MAIL FROM
-        4. RCPT TO (aquí se verifica el mailbox)
-        5. Analizar respuesta
+        1. Tomar una conexión del pool, o conectar al servidor MX + EHLO/HELO
+        2. MAIL FROM
+        3. RCPT TO por email (aquí se verifica el mailbox) + sonda catch-all
+        4. Analizar respuestas
+        5. RSET y devolver la conexión al pool
         """
+        if not emails:
+            return []
+        
+        pooled = await self.pool.acquire(mx_host)
+        
+        if pooled:
+            smtp, rcpts = pooled
+            try:
+                return await self._verify_on_connection(smtp, emails, mx_host, rcpts)
+            except (aiosmtplib.SMTPException, OSError):
+                # El servidor cerró la conexión ociosa: reintentar con una nueva
+                pass
+        
         smtp = None
         
         try:
-            # Conectar al servidor MX en el puerto 25
-            smtp = smtplib.SMTP(timeout=self.timeout)
-            smtp.set_debuglevel(0)  # 0 = sin debug, 1 = con debug
-            
-            # Conectar
-            code, message = smtp.connect(mx_host, 25)
-            
-            if code != 220:
-                return False, f"Connection failed: {code} {message.decode()}", False
-            
-            # HELO/EHLO
-            smtp.helo(self._get_local_hostname())
-            
-            # MAIL FROM (usar un email genérico)
-            code, message = smtp.mail(self.from_email)
-            
-            if code not in (250, 251):
-                return False, f"MAIL FROM rejected: {code}", False
-            
-            # RCPT TO - Este es el comando crítico
-            code, message = smtp.rcpt(email)
-            response_text = message.decode() if isinstance(message, bytes) else str(message)
-            
-            # Analizar respuesta
-            exists = self._analyze_smtp_response(code, response_text)
+            # Conectar al servidor MX en el puerto 25; sin STARTTLS: para
+            # RCPT TO no hace falta y muchos MX tienen certificados inválidos
+            smtp = aiosmtplib.SMTP(
+                hostname=mx_host,
+                port=25,
+                local_hostname=self._local_hostname,
+                timeout=self.timeout,
+                start_tls=False
+            )
             
-            # Detectar catch-all (algunos servidores aceptan TODO)
-            is_catch_all = self._is_catch_all_domain(smtp, email)
+            # Conectar (el banner distinto de 220 llega como excepción)
+            try:
+                await smtp.connect()
+            except aiosmtplib.SMTPConnectResponseError as e:
+                return [(False, f"Connection failed: {e.code} {e.message}", False)] * len(emails)
             
-            # QUIT
-            smtp.quit()
+            # EHLO (necesario para saber si hay SMTPUTF8); HELO si no lo soporta
+            try:
+                await smtp.ehlo()
+            except aiosmtplib.SMTPHeloError:
+                await smtp.helo()
             
-            return exists, f"{code} {response_text}", is_catch_all
+            result = await self._verify_on_connection(smtp, emails, mx_host, 0)
+            # La conexión quedó en el pool (o ya se cerró)
+            smtp = None
+            return result
             
-        except smtplib.SMTPServerDisconnected:
-            return None, "SMTP verification inconclusive: mail server closed the connection unexpectedly", False
-
-        except smtplib.SMTPConnectError:
-            return None, "SMTP verification inconclusive: could not establish connection to the mail server", False
-
-        except socket.timeout:
-            return None, "SMTP verification inconclusive: mail server did not respond before timeout", False
-
-        except socket.gaierror:
-            return None, "SMTP verification inconclusive: MX host could not be resolved", False
-
-        except OSError as e:
-            if "Network is unreachable" in str(e):
-                return None, "SMTP verification inconclusive: network access to the mail server is unavailable", False
-            return None, "SMTP verification inconclusive: network-related error during mailbox verification", False
-
-        except Exception:
-            return None, "SMTP verification inconclusive: temporary technical error during mailbox verification", False
+        except Exception as e:
+            return [(None, self._inconclusive_message(e), False)] * len(emails)
             
         finally:
             if smtp:
-                try:
-                    smtp.quit()
-                except:
-                    pass
+                await self.pool.close_connection(smtp)
+    
+    @staticmethod
+    def _inconclusive_message(error: Exception) -> str:
+        """
+        Mensaje para un error de conexión/red durante la verificación
+        """
+        # aiosmtplib envuelve los errores de socket de connect() en
+        # SMTPConnectError; el original queda en __cause__
+        cause = error.__cause__ if isinstance(error, aiosmtplib.SMTPConnectError) else None
+        
+        if isinstance(error, aiosmtplib.SMTPServerDisconnected):
+            return "SMTP verification inconclusive: mail server closed the connection unexpectedly"
+        if isinstance(error, (aiosmtplib.SMTPTimeoutError, socket.timeout)):
+            return "SMTP verification inconclusive: mail server did not respond before timeout"
+        if isinstance(error, aiosmtplib.SMTPConnectError) and cause is None:
+            return "SMTP verification inconclusive: could not establish connection to the mail server"
+        
+        error = cause or error
+        if isinstance(error, socket.gaierror):
+            return "SMTP verification inconclusive: MX host could not be resolved"
+        if isinstance(error, OSError):
+            if "Network is unreachable" in str(error):
+                return "SMTP verification inconclusive: network access to the mail server is unavailable"
+            return "SMTP verification inconclusive: network-related error during mailbox verification"
+        return "SMTP verification inconclusive: temporary technical error during mailbox verification"
+    
+    async def _verify_on_connection(
+        self,
+        smtp: aiosmtplib.SMTP,
+        emails: list,
+        mx_host: str,
+        rcpts: int
+    ) -> list:
+        """
+        MAIL FROM + RCPT TO sobre una conexión ya saludada (EHLO/HELO)
+        
+        Hasta RCPT_PER_TRANSACTION destinatarios por transacción, cada una
+        cerrada con RSET. Al final devuelve la conexión al pool; si algo
+        falla a mitad de camino, la cierra. Los errores de red se propagan.
+        """
+        results = []
+        
+        try:
+            for i in range(0, len(emails), RCPT_PER_TRANSACTION):
+                chunk = emails[i:i + RCPT_PER_TRANSACTION]
+                
+                # Direcciones no ASCII solo si el servidor anuncia SMTPUTF8
+                # (RFC 6531); si no, quedan inconclusas sin tocar al resto
+                utf8 = smtp.supports_extension("smtputf8")
+                sendable = [e for e in chunk if utf8 or e.isascii()]
+                
+                # MAIL FROM (usar un email genérico). execute_command no
+                # lanza excepción ante un código de error: se evalúa aquí
+                mail_args = [f"FROM:<{self.from_email}>".encode("ascii")]
+                if not all(e.isascii() for e in sendable):
+                    mail_args.append(b"SMTPUTF8")
+                response = await smtp.execute_command(b"MAIL", *mail_args)
+                
+                if response.code not in (250, 251):
+                    await self.pool.close_connection(smtp)
+                    rejected = (False, f"MAIL FROM rejected: {response.code}", False)
+                    return results + [rejected] * (len(emails) - len(results))
+                
+                # RCPT TO - Este es el comando crítico
+                replies = dict(zip(sendable, await self._rcpt_many(smtp, sendable)))
+                rcpts += len(replies)
+                
+                # Detectar catch-all (algunos servidores aceptan TODO) con
+                # una dirección obviamente inválida. Es propiedad del dominio:
+                # se sondea una vez por dominio (cache) y solo si alguna
+                # dirección fue aceptada; un rechazo ya descarta catch-all
+                catch_all = {}
+                to_probe = []
+                for email, (code, _) in replies.items():
+                    domain = email.rpartition("@")[2]
+                    if domain in catch_all or not 200 <= code < 300:
+                        continue
+                    cached = self.catch_all_cache.get(domain)
+                    if cached is None:
+                        catch_all[domain] = False
+                        to_probe.append(domain)
+                    else:
+                        catch_all[domain] = cached
+                
+                if to_probe:
+                    probe_replies = await self._rcpt_many(
+                        smtp, [f"nonexistent-test-12345@{d}" for d in to_probe]
+                    )
+                    rcpts += len(probe_replies)
+                    for domain, (code, _) in zip(to_probe, probe_replies):
+                        # Solo respuestas definitivas (2xx / 5xx) van al cache
+                        if code in (250, 251):
+                            catch_all[domain] = True
+                            self.catch_all_cache.set(domain, True)
+                        elif 500 <= code < 600:
+                            self.catch_all_cache.set(domain, False)
+                
+                for email in chunk:
+                    if email not in replies:
+                        results.append((None, NON_ASCII_MESSAGE, False))
+                        continue
+                    code, response_text = replies[email]
+                    # Analizar respuesta
+                    exists = self._analyze_smtp_response(code, response_text)
+                    results.append((
+                        exists,
+                        f"{code} {response_text}",
+                        catch_all.get(email.rpartition("@")[2], False)
+                    ))
+                
+                # RSET en lugar de QUIT: la sesión sigue abierta
+                rset_code = (await smtp.execute_command(b"RSET")).code
+                if rset_code != 250:
+                    break
+        except BaseException:
+            await self.pool.close_connection(smtp)
+            raise
+        
+        if len(results) < len(emails):
+            # RSET rechazado a mitad de camino: el resto en otra conexión
+            await self.pool.close_connection(smtp)
+            return results + await self._verify_mailboxes(mx_host, emails[len(results):])
+        
+        if rset_code == 250:
+            await self.pool.release(mx_host, smtp, rcpts)
+        else:
+            await self.pool.close_connection(smtp)
+        
+        return results
+    
+    async def _rcpt_many(self, smtp: aiosmtplib.SMTP, addresses: list) -> list:
+        """
+        RCPT TO para cada dirección, en orden, sobre la misma transacción
+        
+        Sin pipeline (RFC 2920): aiosmtplib descarta las respuestas que
+        llegan sin un comando pendiente, así que se espera cada una
+        
+        Returns:
+            Lista de (código, mensaje)
+        """
+        replies = []
+        for address in addresses:
+            r = await smtp.execute_command(f"RCPT TO:<{address}>".encode("utf-8"))
+            replies.append((r.code, r.message))
+        return replies
     
     def _analyze_smtp_response(self, code: int, message: str) -> bool:
         """
@@ -176,29 +445,6 @@ class SMTPValidator:
         # Por defecto, si el código es 2xx consideramos que existe
         return 200 <= code < 300
     
-    def _is_catch_all_domain(self, smtp: smtplib.SMTP, email: str) -> bool:
-        """
-        Detecta si el dominio acepta todos los emails (catch-all)
-        
-        Prueba con un email aleatorio. Si lo acepta, probablemente es catch-all.
-        """
-        try:
-            domain = email.split('@')[1]
-            # Usar un email obviamente inválido
-            test_email = f"nonexistent-test-12345@{domain}"
-            
-            code, message = smtp.rcpt(test_email)
-            
-            # Si acepta este email obviamente falso, es catch-all
-            if code in (250, 251):
-                return True
-            
-            return False
-            
-        except Exception:
-            # Si hay error, asumir que no es catch-all
-            return False
-    
     def _get_local_hostname(self) -> str:
         """
         Obtiene el hostname local para el comando HELO
@@ -213,40 +459,73 @@ class SMTPValidator:
         email: str,
         mx_records: list
     ) -> Tuple[Optional[bool], str, bool]:
-        if not mx_records:
+        """
+        Verifica contra hasta 3 servidores MX, en orden de prioridad, y se
+        queda con la primera respuesta concluyente
+        
+        Se empieza por el MX primario. El siguiente arranca en cuanto uno
+        vuelve inconcluso, o si pasan SMTP_HEDGE_DELAY segundos sin
+        respuesta (en paralelo con el que sigue esperando): un MX caído no
+        suma su timeout completo, y en el caso normal hay una sola sesión
+        SMTP por email. Al volver, las verificaciones pendientes se
+        cancelan. Si ninguno es concluyente, se devuelve el resultado del
+        MX de mayor prioridad.
+        """
+        hosts = [mx.host for mx in mx_records if getattr(mx, "host", None)][:3]
+        
+        if not hosts:
             return None, "SMTP verification skipped: no MX records found", False
-
-        last_result = (None, "SMTP verification inconclusive: no reacheable mail server responded", False)
-
-        for mx_record in mx_records[:3]:
-            if not getattr(mx_record, "host", None):
-                continue
-
-            exists, response, is_catch_all = await self.verify_mailbox(
-                email,
-                mx_record.host
-            )
-
-            last_result = (exists, response, is_catch_all)
-
-            response_lower = response.lower()
-
-            non_conclusive_markers = [
-                "timeout",
-                "error",
-                "could not resolve",
-                "connection failed",
-                "server disconnected",
-                "connection error",
-            ]
-
-            if exists is True:
-                return exists, response, is_catch_all
-            
-            if exists is False and not any(marker in response_lower for marker in non_conclusive_markers):
-                return exists, response, is_catch_all
-
-        return last_result
+        
+        tasks = {}
+        inconclusive = {}
+        pending = set()
+        
+        try:
+            while True:
+                if len(tasks) < len(hosts):
+                    # Primer MX, o uno volvió inconcluso, o venció la espera
+                    task = asyncio.create_task(
+                        self.verify_mailbox(email, hosts[len(tasks)])
+                    )
+                    tasks[task] = len(tasks)
+                    pending.add(task)
+                if not pending:
+                    break
+                
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=settings.SMTP_HEDGE_DELAY if len(tasks) < len(hosts) else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in sorted(done, key=tasks.get):
+                    result = task.result()
+                    if self._is_conclusive(result):
+                        return result
+                    inconclusive[tasks[task]] = result
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        return inconclusive[min(inconclusive)]
+    
+    @staticmethod
+    def _is_conclusive(result: Tuple[Optional[bool], str, bool]) -> bool:
+        exists, response, _ = result
+        
+        if exists is True:
+            return True
+        
+        non_conclusive_markers = [
+            "timeout",
+            "error",
+            "could not resolve",
+            "connection failed",
+            "server disconnected",
+            "connection error",
+        ]
+        response_lower = response.lower()
+        
+        return exists is False and not any(marker in response_lower for marker in non_conclusive_markers)
 
 # Singleton instance
 smtp_validator = SMTPValidator()
@@ -1,11 +1,62 @@
+import asyncio
+import logging
 import re
+from operator import itemgetter
 import dns.resolver
-import asyncio
-from typing import Optional, List
-from email_validator import validate_email, EmailNotValidError
-from app.models.schemas import MXRecord
+from types import MappingProxyType
+from typing import Mapping, Optional, List
+from app.models.schemas import EMAIL_SHAPE_RE, MXRecord
 from app.core.config import settings
+from app.checkers.mx import build_resolver, resolve_implicit_mx
+from app.checkers.syntax import parse_email
 from app.services.smtp_validator import smtp_validator
+from app.services.cache import DomainCache
+from app.services.disposable import BUILTIN_DISPOSABLE_DOMAINS, is_disposable_domain
+
+logger = logging.getLogger(__name__)
+
+# TTL (segundos) de las respuestas MX en cache: el del propio registro, con este tope
+MX_CACHE_TTL = 3600
+# TTL (segundos) de las respuestas MX negativas en cache (NXDOMAIN, sin MX/A/AAAA)
+NEGATIVE_MX_TTL = 300
+
+
+def _deliverability_score(
+    syntax_valid: bool,
+    has_mx: bool,
+    is_disposable: bool,
+    mailbox_exists: Optional[bool]
+) -> float:
+    score = 0.0
+    
+    if syntax_valid:
+        score += 20
+    
+    if has_mx:
+        score += 30
+    
+    if not is_disposable:
+        score += 20
+    
+    if mailbox_exists is True:
+        score += 30
+    elif mailbox_exists is None:
+        # SMTP check not performed, give partial credit
+        score += 15
+    
+    return round(score, 2)
+
+
+# Todas las combinaciones (2*2*2*3) precalculadas una vez: el score es una búsqueda
+SCORE_TABLE: Mapping[tuple, float] = MappingProxyType({
+    (syntax_valid, has_mx, is_disposable, mailbox_exists): _deliverability_score(
+        syntax_valid, has_mx, is_disposable, mailbox_exists
+    )
+    for syntax_valid in (False, True)
+    for has_mx in (False, True)
+    for is_disposable in (False, True)
+    for mailbox_exists in (None, False, True)
+})
 
 
 class EmailValidatorService:
@@ -13,20 +64,22 @@ class EmailValidatorService:
     Core email validation service with multiple validation strategies
     """
     
-    # Common disposable email domains (subset - will expand)
-    DISPOSABLE_DOMAINS = {
-        "tempmail.com", "throwaway.email", "guerrillamail.com",
-        "10minutemail.com", "mailinator.com", "maildrop.cc",
-        "temp-mail.org", "getnada.com", "trashmail.com",
-        "yopmail.com", "sharklasers.com", "guerrillamail.info",
-        "grr.la", "guerrillamail.biz", "guerrillamail.de",
-        "spam4.me", "getairmail.com", "fakeinbox.com"
-    }
+    # Lista curada; el conjunto vigente (lista + tabla DisposableDomain) vive
+    # en app.services.disposable
+    DISPOSABLE_DOMAINS = BUILTIN_DISPOSABLE_DOMAINS
     
     def __init__(self):
-        self.dns_resolver = dns.resolver.Resolver()
-        self.dns_resolver.timeout = 5
-        self.dns_resolver.lifetime = 5
+        # Resolver asincrono nativo de dnspython: no ocupa hilos del executor
+        self.dns_resolver = build_resolver()
+        # MX por dominio compartido entre requests (solo resultados concluyentes)
+        self.mx_cache = DomainCache(ttl_seconds=MX_CACHE_TTL, maxsize=50_000)
+    
+    @staticmethod
+    def has_valid_shape(email: str) -> bool:
+        """
+        Chequeo previo barato de la forma local@dominio.tld (sin parseo RFC/IDNA)
+        """
+        return EMAIL_SHAPE_RE.match(email) is not None
     
     def validate_syntax(self, email: str) -> tuple[bool, Optional[str]]:
         """
@@ -35,18 +88,18 @@ class EmailValidatorService:
         Returns:
             (is_valid, normalized_email or None)
         """
-        try:
-            validated = validate_email(email, check_deliverability=False)
-            return True, validated.normalized
-        except EmailNotValidError as e:
+        if not self.has_valid_shape(email):
             return False, None
+        
+        # Se parsea una vez por dirección distinta (LRU compartido con el orquestador)
+        normalized, _ = parse_email(email)
+        return normalized is not None, normalized
     
     def extract_domain(self, email: str) -> Optional[str]:
         """Extract domain from email address"""
-        try:
-            return email.split('@')[1].lower()
-        except (IndexError, AttributeError):
-            return None
+        # Último '@': también sirve si la parte local entre comillas contiene uno
+        _, sep, domain = email.rpartition('@')
+        return domain.lower() if sep else None
     
     def is_disposable_email(self, email: str) -> bool:
         """
@@ -56,7 +109,7 @@ class EmailValidatorService:
         if not domain:
             return False
         
-        return domain in self.DISPOSABLE_DOMAINS
+        return is_disposable_domain(domain)
     
     async def check_mx_records(self, domain: str) -> tuple[bool, List[MXRecord]]:
         """
@@ -65,37 +118,63 @@ class EmailValidatorService:
         Returns:
             (has_mx, list of MX records)
         """
+        # Búsquedas concurrentes del mismo dominio sin cache comparten una consulta
+        return await self.mx_cache.get_or_load(domain, lambda: self._lookup_mx(domain))
+    
+    def _cache_mx(
+        self,
+        domain: str,
+        result: tuple[bool, List[MXRecord]],
+        ttl: Optional[float] = None
+    ) -> tuple[bool, List[MXRecord]]:
+        # Las respuestas negativas vencen antes: un dominio que se está
+        # configurando no debe quedar "sin MX" durante una hora
+        if not result[0]:
+            ttl = NEGATIVE_MX_TTL
+        self.mx_cache.set(domain, result, ttl=ttl)
+        return result
+    
+    async def _lookup_mx(self, domain: str) -> tuple[bool, List[MXRecord]]:
+        """
+        Consulta DNS detrás de check_mx_records; cachea las respuestas concluyentes
+        """
         mx_records = []
         
         try:
-            # Run DNS query in executor to avoid blocking
-            loop = asyncio.get_event_loop()
-            answers = await loop.run_in_executor(
-                None,
-                lambda: self.dns_resolver.resolve(domain, 'MX')
-            )
+            # lifetime acota la consulta completa (reintentos incluidos)
+            answers = await self.dns_resolver.resolve(domain, 'MX')
             
+            # Tuplas (host, prioridad) simples mientras se ordena; los modelos
+            # se arman con datos DNS ya parseados aquí, sin validación
+            pairs = []
             for rdata in answers:
                 host = str (rdata.exchange).rstrip('.').strip()
-                priority = int(rdata.preference)
-
                 if host:
-                    mx_records.append(
-                        MXRecord(
-                            host=host,
-                            priority=priority
-                        )
-                    )
+                    pairs.append((host, int(rdata.preference)))
             
             # Sort by priority (lower is higher priority)
-            mx_records.sort(key=lambda x: x.priority)
+            pairs.sort(key=itemgetter(1))
+            mx_records = [
+                MXRecord.model_construct(host=host, priority=priority)
+                for host, priority in pairs
+            ]
             
-            return len(mx_records) > 0, mx_records
+            # No guardar la respuesta más de lo que permite el propio registro DNS
+            ttl = min(answers.rrset.ttl, MX_CACHE_TTL)
+            return self._cache_mx(domain, (len(mx_records) > 0, mx_records), ttl)
             
-        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer, dns.resolver.NoNameservers):
-            return False, []
+        except dns.resolver.NoAnswer:
+            # Sin MX: el propio dominio es el MX implícito si tiene A/AAAA
+            try:
+                mx_records = await resolve_implicit_mx(self.dns_resolver, domain)
+            except Exception as e:
+                logger.warning(f"A/AAAA lookup error for {domain}: {e}")
+                return False, []
+            return self._cache_mx(domain, (len(mx_records) > 0, mx_records))
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoNameservers):
+            return self._cache_mx(domain, (False, []))
         except Exception as e:
-            print(f"MX lookup error for {domain}: {e}")
+            logger.warning(f"MX lookup error for {domain}: {e}")
             return False, []
     
     def calculate_deliverability_score(
@@ -108,35 +187,24 @@ class EmailValidatorService:
         """
         Calculate overall deliverability score (0-100)
         
-        Scoring breakdown:
+        Scoring breakdown (ver _deliverability_score):
         - Syntax valid: 20 points
         - Has MX records: 30 points
         - Not disposable: 20 points
         - Mailbox exists: 30 points
         """
-        score = 0.0
-        
-        if syntax_valid:
-            score += 20
-        
-        if has_mx:
-            score += 30
-        
-        if not is_disposable:
-            score += 20
-        
-        if mailbox_exists is True:
-            score += 30
-        elif mailbox_exists is None:
-            # SMTP check not performed, give partial credit
-            score += 15
-        
-        return round(score, 2)
+        return SCORE_TABLE[(
+            bool(syntax_valid),
+            bool(has_mx),
+            bool(is_disposable),
+            None if mailbox_exists is None else bool(mailbox_exists)
+        )]
     
     async def validate_email(
         self,
         email: str,
-        check_smtp: bool = True
+        check_smtp: bool = True,
+        mx_results: Optional[dict] = None
     ) -> dict:
         """
         Perform comprehensive email validation
@@ -144,6 +212,8 @@ class EmailValidatorService:
         Args:
             email: Email address to validate
             check_smtp: Whether to perform SMTP verification
+            mx_results: Resultados de check_mx_records ya resueltos por el
+                caller, por dominio (bulk resuelve cada dominio una vez)
             
         Returns:
             Dictionary with validation results
@@ -183,10 +253,17 @@ class EmailValidatorService:
             return result
         
         # Step 3: Check if disposable
-        result["is_disposable"] = self.is_disposable_email(email)
+        result["is_disposable"] = is_disposable_domain(domain)
         
         # Step 4: Check MX records
-        has_mx, mx_records = await self.check_mx_records(domain)
+        mx_result = mx_results.get(domain) if mx_results else None
+        if mx_result is None:
+            if result["is_disposable"] and settings.SKIP_MX_ON_DISPOSABLE:
+                # Nunca es válido: sin consulta DNS (el score pierde el crédito MX)
+                mx_result = (False, [])
+            else:
+                mx_result = await self.check_mx_records(domain)
+        has_mx, mx_records = mx_result
         result["has_mx_records"] = has_mx
         result["mx_records"] = mx_records
         
@@ -196,23 +273,17 @@ class EmailValidatorService:
         result["has_mx_records"] = len(valid_mx_records) > 0
         result["mx_records"] = valid_mx_records
         
-        if check_smtp and has_mx and valid_mx_records:
+        # Un desechable nunca es válido; con SKIP_SMTP_ON_DISPOSABLE no se
+        # abre la conexión (mailbox_exists queda en None)
+        skip_smtp = result["is_disposable"] and settings.SKIP_SMTP_ON_DISPOSABLE
+        if check_smtp and has_mx and valid_mx_records and not skip_smtp:
             try:
-                result["smtp_check_performed"] = True
-                
                 # Verificar con fallback a múltiples MX servers
-                mailbox_exists, smtp_response, is_catch_all = await smtp_validator.verify_with_fallback(
+                outcome = await smtp_validator.verify_with_fallback(
                     email, 
                     valid_mx_records
                 )
-                
-                result["mailbox_exists"] = mailbox_exists
-                result["smtp_response"] = smtp_response
-                result["is_catch_all"] = is_catch_all
-                
-                # Si es catch-all, reducir confianza
-                if is_catch_all:
-                    result["smtp_response"] += " (Warning: Catch-all domain detected)"
+                self._apply_smtp_outcome(result, outcome)
                     
             except Exception as e:
                 result["smtp_check_performed"] = False
@@ -220,6 +291,84 @@ class EmailValidatorService:
                 result["smtp_response"] = f"SMTP check failed: {str(e)}"
         
         # Calculate final score
+        self._finalize(result)
+        
+        return result
+    
+    async def verify_smtp_batch(self, results: list[dict]) -> None:
+        """
+        Verificación SMTP, in place, de resultados ya validados (bulk)
+        """
+        async for _ in self.iter_smtp_batch(results):
+            pass
+    
+    async def iter_smtp_batch(self, results: list[dict]):
+        """
+        Verificación SMTP, in place, de resultados ya validados; los entrega
+        por grupos a medida que quedan definitivos
+        
+        Primero van los que no necesitan SMTP (inválidos, sin MX, o
+        desechables con SKIP_SMTP_ON_DISPOSABLE). El resto se agrupa por host
+        MX primario: cada host recibe una sola sesión SMTP con todos sus RCPT
+        TO (smtp_validator.verify_mailboxes) y su grupo se entrega en cuanto
+        termina. Las direcciones que el host primario deja inconclusas pasan
+        por el fallback por email de siempre en los demás hosts MX.
+        """
+        by_host: dict[str, list[dict]] = {}
+        skipped = []
+        for result in results:
+            skip_smtp = result["is_disposable"] and settings.SKIP_SMTP_ON_DISPOSABLE
+            if result["syntax_valid"] and result["has_mx_records"] and not skip_smtp:
+                by_host.setdefault(result["mx_records"][0].host, []).append(result)
+            else:
+                skipped.append(result)
+        
+        if skipped:
+            yield skipped
+        
+        async def verify_host(host: str, group: list[dict]) -> list[dict]:
+            outcomes = await smtp_validator.verify_mailboxes(
+                host, [r["email"] for r in group]
+            )
+            await asyncio.gather(*(
+                finish(result, outcome) for result, outcome in zip(group, outcomes)
+            ))
+            return group
+        
+        async def finish(result: dict, outcome: tuple) -> None:
+            if outcome[0] is None and len(result["mx_records"]) > 1:
+                outcome = await smtp_validator.verify_with_fallback(
+                    result["email"], result["mx_records"][1:]
+                )
+            self._apply_smtp_outcome(result, outcome)
+            self._finalize(result)
+        
+        tasks = [asyncio.create_task(verify_host(h, g)) for h, g in by_host.items()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # El consumidor cortó antes (cliente desconectado) o falló un host
+            for task in tasks:
+                task.cancel()
+    
+    @staticmethod
+    def _apply_smtp_outcome(result: dict, outcome: tuple) -> None:
+        mailbox_exists, smtp_response, is_catch_all = outcome
+        
+        result["smtp_check_performed"] = True
+        result["mailbox_exists"] = mailbox_exists
+        result["smtp_response"] = smtp_response
+        result["is_catch_all"] = is_catch_all
+        
+        # Si es catch-all, reducir confianza
+        if is_catch_all:
+            result["smtp_response"] += " (Warning: Catch-all domain detected)"
+    
+    def _finalize(self, result: dict) -> None:
+        """
+        Score final y validez general a partir de los checks reunidos
+        """
         result["deliverability_score"] = self.calculate_deliverability_score(
             syntax_valid=result["syntax_valid"],
             has_mx=result["has_mx_records"],
@@ -233,8 +382,6 @@ class EmailValidatorService:
             result["has_mx_records"] and
             not result["is_disposable"]
         )
-        
-        return result
 
 
 # Singleton instance